@@ -0,0 +1,170 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Потокобезопасный кэш с ограничением размера (LRU) и временем жизни записей"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            # Вытесняем давно не использованные записи
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+class RefreshingCache:
+    """LRU-кэш со stale-while-revalidate: после ttl запись еще stale_ttl секунд отдается сразу,
+    а новое значение загружается в фоне.
+
+    load/save - необязательный второй уровень (например, SQLite), переживающий перезапуск:
+    load(key) возвращает (value, fetched_at) или None, save(key, value, fetched_at) сохраняет запись.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, stale_ttl=86400, load=None, save=None, workers=2):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._load = load
+        self._save = save
+        self._data = OrderedDict()  # key -> (value, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-refresh")
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                return entry
+
+        if self._load is None:
+            return None
+        entry = self._load(key)
+        if entry is not None:
+            self._store(key, *entry)
+        return entry
+
+    def _store(self, key, value, fetched_at):
+        with self._lock:
+            self._data[key] = (value, fetched_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def set(self, key, value):
+        fetched_at = time.time()
+        self._store(key, value, fetched_at)
+        if self._save is not None:
+            self._save(key, value, fetched_at)
+
+    def get(self, key, loader):
+        # loader() загружает значение; None не кэшируется
+        entry = self._lookup(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                with self._lock:
+                    self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                with self._lock:
+                    self.stale_hits += 1
+                self._refresh(key, loader)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def _refresh(self, key, loader):
+        # Одно фоновое обновление на ключ, даже если запись запрашивают часто
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._run_refresh, key, loader)
+
+    def _run_refresh(self, key, loader):
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+                with self._lock:
+                    self.refreshes += 1
+        except Exception as e:
+            logger.error(f"Error refreshing cache entry {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits + self.stale_hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0
+            }
+
+def normalize_query(query):
+    # "  Billie   EILISH " и "billie eilish" - один и тот же запрос
+    return " ".join(str(query).lower().split())
+
+# Результаты поиска артистов на обеих платформах: ключ (платформа, нормализованный запрос)
+search_cache = TTLCache(maxsize=2048, ttl=6 * 3600)
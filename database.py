@@ -1,5 +1,8 @@
 import sqlite3
 import logging
+import threading
+import json
+import zlib
 
 # Очищаем лог файл при запуске
 with open("database.log", "w") as f:
@@ -14,8 +17,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 # Подключение к базе данных (файл database.db)
-conn = sqlite3.connect("database.db", check_same_thread=False)
-cursor = conn.cursor()
+DB_PATH = "database.db"
+# Сколько секунд ждать, пока другой поток освободит блокировку на запись
+DB_BUSY_TIMEOUT = 30
+# Размер кэша подготовленных запросов в каждом соединении
+DB_CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+def get_connection():
+    # У каждого потока (бот, планировщик, отправка уведомлений) свое соединение и свой курсор,
+    # поэтому запросы разных потоков не перемешиваются и не ждут друг друга на чтении
+    connection = getattr(_local, "conn", None)
+    if connection is None:
+        connection = sqlite3.connect(
+            DB_PATH,
+            timeout=DB_BUSY_TIMEOUT,
+            cached_statements=DB_CACHED_STATEMENTS
+        )
+        # В режиме WAL достаточно синхронизации на контрольных точках
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT * 1000}")
+        _local.conn = connection
+        _local.cursor = connection.cursor()
+    return connection
+
+class _ThreadLocal:
+    """Перенаправляет обращения к conn/cursor на соединение текущего потока"""
+
+    def __init__(self, attr):
+        self._attr = attr
+
+    def __getattr__(self, name):
+        get_connection()
+        return getattr(getattr(_local, self._attr), name)
+
+conn = _ThreadLocal("conn")
+cursor = _ThreadLocal("cursor")
+
+# WAL сохраняется в файле базы: читатели не блокируют запись сканера и наоборот
+get_connection().execute("PRAGMA journal_mode=WAL")
 
 # Создание таблиц
 def migrate_db():
@@ -72,6 +113,42 @@ def migrate_db():
         conn.rollback()
         raise
 
+# Индексы под частые запросы. Версия схемы индексов хранится в PRAGMA user_version:
+# новые индексы добавляются следующей версией в конец списка
+INDEX_MIGRATIONS = [
+    (1, [
+        # has_subscription, remove_subscription, update_subscription_date, get_subscriptions
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_user_artist ON subscriptions(user_id, artist_id)",
+        # Подписчики артиста для сканера релизов
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_platform_artist ON subscriptions(platform, artist_id)",
+        # get_pending_payments
+        "CREATE INDEX IF NOT EXISTS idx_payment_requests_status ON payment_requests(status)",
+        # get_payment_history
+        "CREATE INDEX IF NOT EXISTS idx_payment_requests_user ON payment_requests(user_id, timestamp)",
+        # get_pending_notifications
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON notification_outbox(status, next_attempt_at)"
+    ]),
+    (2, [
+        # Подписки одного среза сканера (get_artist_subscribers с диапазонами scan_hash)
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_scan_hash ON subscriptions(scan_hash)"
+    ])
+]
+
+def get_scan_hash(platform, artist_id):
+    # crc32 вместо hash(): значение не должно меняться между перезапусками
+    return zlib.crc32(f"{platform}:{artist_id}".encode())
+
+def apply_index_migrations():
+    cursor.execute("PRAGMA user_version")
+    current_version = cursor.fetchone()[0]
+    for version, statements in INDEX_MIGRATIONS:
+        if version <= current_version:
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {version}")
+        logger.info(f"Индексы обновлены до версии {version}")
+
 def init_db():
     try:
         # Проверяем существование таблицы users
@@ -117,6 +194,7 @@ def init_db():
                 artist_name TEXT,
                 platform TEXT,
                 subscription_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                scan_hash INTEGER,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             )
         """)
@@ -133,6 +211,69 @@ def init_db():
             )
         """)
         
+        # Состояние сканера релизов, чтобы после перезапуска продолжить с того же места
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scan_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS artist_poll_state (
+                platform TEXT,
+                artist_id TEXT,
+                last_checked REAL,
+                latest_release TEXT,
+                hot_until REAL DEFAULT 0,
+                PRIMARY KEY (platform, artist_id)
+            )
+        """)
+        
+        # Очередь уведомлений: сканер пишет сюда, отдельный поток отправляет в Telegram
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                message TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                last_error TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                sent_at DATETIME
+            )
+        """)
+        
+        # Каталог артистов: метаданные и последние известные релизы,
+        # чтобы карточка артиста открывалась без запросов к платформе
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS artists (
+                platform TEXT,
+                artist_id TEXT,
+                name TEXT,
+                followers INTEGER,
+                link TEXT,
+                image TEXT,
+                latest_album TEXT,
+                latest_single TEXT,
+                releases_checked_at REAL,
+                last_refreshed_at REAL,
+                PRIMARY KEY (platform, artist_id)
+            )
+        """)
+        
+        # Второй уровень кэша топ-треков, чтобы после перезапуска не загружать их заново
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS top_tracks_cache (
+                platform TEXT,
+                artist_id TEXT,
+                tracks TEXT,
+                fetched_at REAL,
+                PRIMARY KEY (platform, artist_id)
+            )
+        """)
+        
         # Проверяем, существует ли столбец subscription_date
         cursor.execute("PRAGMA table_info(subscriptions)")
         columns = cursor.fetchall()
@@ -171,6 +312,19 @@ def init_db():
             
             logger.info("Added subscription_date column to subscriptions table")
         
+        # Хэш артиста для выбора подписок среза сканера индексом, без загрузки всех подписок
+        cursor.execute("PRAGMA table_info(subscriptions)")
+        if not any(column[1] == 'scan_hash' for column in cursor.fetchall()):
+            cursor.execute("ALTER TABLE subscriptions ADD COLUMN scan_hash INTEGER")
+            logger.info("Added scan_hash column to subscriptions table")
+        cursor.execute("SELECT DISTINCT platform, artist_id FROM subscriptions WHERE scan_hash IS NULL")
+        cursor.executemany(
+            "UPDATE subscriptions SET scan_hash = ? WHERE platform = ? AND artist_id = ?",
+            [(get_scan_hash(platform, artist_id), platform, artist_id) for platform, artist_id in cursor.fetchall()]
+        )
+        
+        conn.commit()
+        apply_index_migrations()
         conn.commit()
         logger.info("База данных инициализирована")
         
@@ -219,21 +373,17 @@ def add_subscription(chat_id, artist_id, artist_name, platform):
     user_id = user[0]
     cursor.execute("""
         INSERT INTO subscriptions 
-        (user_id, artist_id, artist_name, platform, subscription_date) 
-        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-    """, (user_id, artist_id, artist_name, platform))
+        (user_id, artist_id, artist_name, platform, subscription_date, scan_hash) 
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+    """, (user_id, artist_id, artist_name, platform, get_scan_hash(platform, artist_id)))
     conn.commit()
     logger.info(f"Подписка добавлена: user_id={user_id}, artist_name={artist_name}, platform={platform}")
 
 # Получение подписок пользователя
-def get_new_connection():
-    return sqlite3.connect("database.db", check_same_thread=False)
-
 def get_subscriptions(chat_id):
     try:
-        # Создаем новое соединение для этого запроса
-        local_conn = get_new_connection()
-        local_cursor = local_conn.cursor()
+        # Отдельный курсор на соединении текущего потока
+        local_cursor = get_connection().cursor()
         
         local_cursor.execute("""
             SELECT 
@@ -248,15 +398,128 @@ def get_subscriptions(chat_id):
         
         result = local_cursor.fetchall()
         
-        # Закрываем локальное соединение
         local_cursor.close()
-        local_conn.close()
         
         return result
     except Exception as e:
         logger.error(f"Error in get_subscriptions: {e}")
         return []
 
+def get_artist_subscribers(hash_ranges=None):
+    # Собираем подписчиков (без mute) и группируем по артисту,
+    # чтобы сканер запрашивал релизы каждого (platform, artist_id) один раз.
+    # hash_ranges: [(low, high), ...] - только подписки с low <= scan_hash < high (срезы сканера)
+    try:
+        local_cursor = get_connection().cursor()
+
+        query = """
+            SELECT
+                subscriptions.platform,
+                subscriptions.artist_id,
+                users.chat_id,
+                subscriptions.artist_name,
+                subscriptions.subscription_date
+            FROM subscriptions
+            JOIN users ON subscriptions.user_id = users.id
+            WHERE users.muted = FALSE
+        """
+        rows = []
+        if hash_ranges is None:
+            local_cursor.execute(query)
+            rows = local_cursor.fetchall()
+        else:
+            for low, high in hash_ranges:
+                local_cursor.execute(
+                    query + " AND subscriptions.scan_hash >= ? AND subscriptions.scan_hash < ?",
+                    (low, high)
+                )
+                rows.extend(local_cursor.fetchall())
+
+        local_cursor.close()
+
+        artists = {}
+        for platform, artist_id, chat_id, artist_name, subscription_date in rows:
+            artists.setdefault((platform, artist_id), []).append(
+                (chat_id, artist_name, subscription_date)
+            )
+        return artists
+    except Exception as e:
+        logger.error(f"Error in get_artist_subscribers: {e}")
+        return {}
+
+# Сколько артистов передавать в одном запросе get_release_cadence (лимит параметров SQLite - 999)
+CADENCE_BATCH_SIZE = 500
+
+def get_release_cadence(keys):
+    # Для каждого из артистов keys [(platform, artist_id), ...]:
+    # число известных релизов и даты первого и последнего из них
+    try:
+        local_cursor = get_connection().cursor()
+
+        keys = set(keys)
+        artist_ids = sorted({artist_id for _, artist_id in keys})
+        cadence = {}
+        for i in range(0, len(artist_ids), CADENCE_BATCH_SIZE):
+            chunk = artist_ids[i:i + CADENCE_BATCH_SIZE]
+            local_cursor.execute(f"""
+                SELECT platform, artist_id, COUNT(*), MIN(release_date), MAX(release_date)
+                FROM releases_history
+                WHERE artist_id IN ({",".join("?" * len(chunk))})
+                GROUP BY artist_id, platform
+            """, chunk)
+            for platform, artist_id, count, first_date, last_date in local_cursor.fetchall():
+                if (platform, artist_id) in keys:
+                    cadence[(platform, artist_id)] = (count, first_date, last_date)
+
+        local_cursor.close()
+
+        return cadence
+    except Exception as e:
+        logger.error(f"Error in get_release_cadence: {e}")
+        return {}
+
+def get_scan_state(key, default=None):
+    try:
+        local_cursor = get_connection().cursor()
+        local_cursor.execute("SELECT value FROM scan_state WHERE key = ?", (key,))
+        result = local_cursor.fetchone()
+        local_cursor.close()
+        return result[0] if result else default
+    except Exception as e:
+        logger.error(f"Error in get_scan_state: {e}")
+        return default
+
+def set_scan_state(key, value):
+    try:
+        cursor.execute(
+            "INSERT OR REPLACE INTO scan_state (key, value) VALUES (?, ?)",
+            (key, str(value))
+        )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error in set_scan_state: {e}")
+
+def load_artist_poll_state():
+    try:
+        local_cursor = get_connection().cursor()
+        local_cursor.execute("""
+            SELECT platform, artist_id, last_checked, latest_release, hot_until
+            FROM artist_poll_state
+        """)
+        rows = local_cursor.fetchall()
+        local_cursor.close()
+        return {
+            (platform, artist_id): {
+                "last_checked": last_checked,
+                "latest_release": latest_release,
+                "hot_until": hot_until or 0
+            }
+            for platform, artist_id, last_checked, latest_release, hot_until in rows
+        }
+    except Exception as e:
+        logger.error(f"Error in load_artist_poll_state: {e}")
+        return {}
+
 def get_db():
     return conn, cursor
 
@@ -329,6 +592,9 @@ def is_muted(chat_id):
     result = cursor.fetchone()
     return result[0] if result else False
 
+# Число подписок без VIP-уровня; каждый уровень добавляет один слот
+BASE_SUBSCRIPTIONS = 5
+
 def get_vip_level(chat_id):
     cursor.execute(
         "SELECT vip_level FROM users WHERE chat_id = ?",
@@ -339,12 +605,31 @@ def get_vip_level(chat_id):
 
 def get_max_subscriptions(chat_id):
     vip_level = get_vip_level(chat_id)
-    return 5 + vip_level
+    return BASE_SUBSCRIPTIONS + vip_level
+
+def get_user_profile(chat_id):
+    # Все, что нужно для отрисовки меню, одним запросом
+    profile = {"muted": False, "vip_level": 0, "subscriptions": 0}
+    try:
+        cursor.execute("""
+            SELECT
+                users.muted,
+                users.vip_level,
+                (SELECT COUNT(*) FROM subscriptions WHERE subscriptions.user_id = users.id)
+            FROM users
+            WHERE users.chat_id = ?
+        """, (chat_id,))
+        result = cursor.fetchone()
+        if result:
+            profile = {"muted": bool(result[0]), "vip_level": result[1] or 0, "subscriptions": result[2]}
+    except Exception as e:
+        logger.error(f"Error in get_user_profile: {e}")
+    profile["max_subscriptions"] = BASE_SUBSCRIPTIONS + profile["vip_level"]
+    return profile
 
 def can_add_subscription(chat_id):
-    current_subs = len(get_subscriptions(chat_id))
-    max_subs = get_max_subscriptions(chat_id)
-    return current_subs < max_subs
+    profile = get_user_profile(chat_id)
+    return profile["subscriptions"] < profile["max_subscriptions"]
 
 def set_vip_level(chat_id, level):
     cursor.execute(
@@ -469,5 +754,245 @@ def update_subscription_date(chat_id, artist_id, release_date):
         logger.error(f"Error updating subscription date: {e}")
         return False
 
+def is_release_known(artist_id, platform, release_id):
+    cursor.execute("""
+        SELECT 1 FROM releases_history
+        WHERE artist_id = ? AND platform = ? AND release_id = ?
+    """, (artist_id, platform, release_id))
+    return cursor.fetchone() is not None
+
+def save_scan_results(releases, notifications, poll_states, artist_releases):
+    # Результаты проверки пачки артистов записываются одной транзакцией: история релизов,
+    # сдвиг дат подписок вместе с уведомлениями в очереди, состояние опроса и последние релизы в каталоге.
+    # Отправитель видит уведомления только после коммита, а после сбоя пачка проверяется заново.
+    # releases: [(artist_id, platform, release_id, release_type, release_date)]
+    # notifications: [(chat_id, artist_id, release_date, message)]
+    # poll_states: [(platform, artist_id, last_checked, latest_release, hot_until)]
+    # artist_releases: [(platform, artist_id, album, single, checked_at)]
+    try:
+        cursor.executemany("""
+            INSERT OR IGNORE INTO releases_history
+            (artist_id, platform, release_id, release_type, release_date)
+            VALUES (?, ?, ?, ?, ?)
+        """, releases)
+        cursor.executemany("""
+            UPDATE subscriptions
+            SET subscription_date = ?
+            WHERE user_id = (SELECT id FROM users WHERE chat_id = ?) AND artist_id = ?
+        """, [(release_date, chat_id, artist_id) for chat_id, artist_id, release_date, _ in notifications])
+        cursor.executemany(
+            "INSERT INTO notification_outbox (chat_id, message) VALUES (?, ?)",
+            [(chat_id, message) for chat_id, _, _, message in notifications]
+        )
+        cursor.executemany("""
+            INSERT OR REPLACE INTO artist_poll_state
+            (platform, artist_id, last_checked, latest_release, hot_until)
+            VALUES (?, ?, ?, ?, ?)
+        """, poll_states)
+        _upsert_artist_releases(artist_releases)
+        conn.commit()
+        logger.info(
+            f"Saved scan results: {len(poll_states)} artists, {len(releases)} releases, "
+            f"{len(notifications)} notifications"
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Error in save_scan_results: {e}")
+        conn.rollback()
+        return False
+
+def _upsert_artist_releases(artist_releases):
+    # Если релиз не получен, в каталоге остается последний известный
+    cursor.executemany("""
+        INSERT INTO artists (platform, artist_id, latest_album, latest_single, releases_checked_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (platform, artist_id) DO UPDATE SET
+            latest_album = COALESCE(excluded.latest_album, artists.latest_album),
+            latest_single = COALESCE(excluded.latest_single, artists.latest_single),
+            releases_checked_at = excluded.releases_checked_at
+    """, [
+        (platform, artist_id, _dump_release(album), _dump_release(single), checked_at)
+        for platform, artist_id, album, single, checked_at in artist_releases
+    ])
+
+def save_artist_releases(platform, artist_id, album, single, checked_at):
+    try:
+        _upsert_artist_releases([(platform, artist_id, album, single, checked_at)])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error in save_artist_releases: {e}")
+        conn.rollback()
+
+def _dump_release(release):
+    return json.dumps(release, ensure_ascii=False) if release else None
+
+def _load_release(value):
+    return json.loads(value) if value else None
+
+def get_artist(platform, artist_id):
+    # Запись каталога или None, если артиста в нем еще нет
+    try:
+        cursor.execute("""
+            SELECT name, followers, link, image, latest_album, latest_single,
+                   releases_checked_at, last_refreshed_at
+            FROM artists
+            WHERE platform = ? AND artist_id = ?
+        """, (platform, artist_id))
+        result = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error in get_artist: {e}")
+        return None
+    if not result:
+        return None
+    name, followers, link, image, latest_album, latest_single, releases_checked_at, last_refreshed_at = result
+    return {
+        "name": name,
+        "followers": followers if followers is not None else "N/A",
+        "link": link,
+        "image": image,
+        "latest_album": _load_release(latest_album),
+        "latest_single": _load_release(latest_single),
+        "releases_checked_at": releases_checked_at,
+        "last_refreshed_at": last_refreshed_at
+    }
+
+def save_artists(platform, artists, refreshed_at):
+    # artists: {artist_id: {"name", "followers", "link", "image"}}
+    try:
+        cursor.executemany("""
+            INSERT INTO artists (platform, artist_id, name, followers, link, image, last_refreshed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (platform, artist_id) DO UPDATE SET
+                name = excluded.name,
+                followers = excluded.followers,
+                link = excluded.link,
+                image = excluded.image,
+                last_refreshed_at = excluded.last_refreshed_at
+        """, [
+            (
+                platform,
+                artist_id,
+                info["name"],
+                info["followers"] if info["followers"] != "N/A" else None,
+                info["link"],
+                info.get("image"),
+                refreshed_at
+            )
+            for artist_id, info in artists.items() if info
+        ])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error in save_artists: {e}")
+        conn.rollback()
+
+def get_stale_artists(older_than, limit):
+    # Артисты с подписчиками, чьи метаданные не обновлялись с older_than; сначала самые старые
+    try:
+        local_cursor = get_connection().cursor()
+        local_cursor.execute("""
+            SELECT DISTINCT subscriptions.platform, subscriptions.artist_id, COALESCE(artists.last_refreshed_at, 0)
+            FROM subscriptions
+            LEFT JOIN artists
+                ON artists.platform = subscriptions.platform AND artists.artist_id = subscriptions.artist_id
+            WHERE artists.last_refreshed_at IS NULL OR artists.last_refreshed_at < ?
+            ORDER BY 3
+            LIMIT ?
+        """, (older_than, limit))
+        result = [(platform, artist_id) for platform, artist_id, _ in local_cursor.fetchall()]
+        local_cursor.close()
+        return result
+    except Exception as e:
+        logger.error(f"Error in get_stale_artists: {e}")
+        return []
+
+def load_top_tracks(key):
+    # key - (platform, artist_id); возвращает (tracks, fetched_at) или None
+    try:
+        cursor.execute(
+            "SELECT tracks, fetched_at FROM top_tracks_cache WHERE platform = ? AND artist_id = ?",
+            key
+        )
+        result = cursor.fetchone()
+        return (json.loads(result[0]), result[1]) if result else None
+    except Exception as e:
+        logger.error(f"Error in load_top_tracks: {e}")
+        return None
+
+def save_top_tracks(key, tracks, fetched_at):
+    platform, artist_id = key
+    try:
+        cursor.execute("""
+            INSERT OR REPLACE INTO top_tracks_cache (platform, artist_id, tracks, fetched_at)
+            VALUES (?, ?, ?, ?)
+        """, (platform, artist_id, json.dumps(tracks, ensure_ascii=False), fetched_at))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error in save_top_tracks: {e}")
+        conn.rollback()
+
+def get_pending_notifications(now, limit):
+    # Самое старое готовое к отправке уведомление для каждого чата,
+    # чтобы один чат с длинной очередью не задерживал остальных
+    try:
+        local_cursor = get_connection().cursor()
+        local_cursor.execute("""
+            SELECT id, chat_id, message FROM notification_outbox
+            WHERE id IN (
+                SELECT MIN(id) FROM notification_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                GROUP BY chat_id
+            )
+            ORDER BY id
+            LIMIT ?
+        """, (now, limit))
+        result = local_cursor.fetchall()
+        local_cursor.close()
+        return result
+    except Exception as e:
+        logger.error(f"Error in get_pending_notifications: {e}")
+        return []
+
+def mark_notification_sent(notification_id):
+    try:
+        cursor.execute("""
+            UPDATE notification_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+            WHERE id = ?
+        """, (notification_id,))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error in mark_notification_sent: {e}")
+        conn.rollback()
+        return False
+
+def mark_notification_failed(notification_id, error):
+    cursor.execute("""
+        UPDATE notification_outbox
+        SET status = 'failed', last_error = ?, attempts = attempts + 1
+        WHERE id = ?
+    """, (str(error), notification_id))
+    conn.commit()
+
+def defer_notification(notification_id, next_attempt_at):
+    # Перенос без учета попытки (например, по retry_after от Telegram)
+    cursor.execute(
+        "UPDATE notification_outbox SET next_attempt_at = ? WHERE id = ?",
+        (next_attempt_at, notification_id)
+    )
+    conn.commit()
+
+def reschedule_notification(notification_id, next_attempt_at, error, max_attempts):
+    # Откладываем повторную отправку; после max_attempts попыток помечаем как failed
+    cursor.execute("""
+        UPDATE notification_outbox
+        SET attempts = attempts + 1,
+            next_attempt_at = ?,
+            last_error = ?,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+        WHERE id = ?
+    """, (next_attempt_at, str(error), max_attempts, notification_id))
+    conn.commit()
+
 # Инициализация базы данных при импорте
-init_db()
\ No newline at end of file
+init_db()
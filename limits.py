@@ -0,0 +1,309 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Пауза после 429, если сервис не сообщил Retry-After
+DEFAULT_RETRY_AFTER = 5
+
+class RateLimiter:
+    """Token bucket для исходящих запросов к платформе.
+
+    После ответа 429 запросы приостанавливаются на Retry-After, а скорость снижается вдвое;
+    при успешных ответах скорость постепенно возвращается к исходной.
+    """
+
+    def __init__(self, name, rate, burst=None, min_rate=None):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or rate / 10
+        self.capacity = burst or max(1, rate)
+        self.throttled = 0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        # Забирает токен и возвращает 0 или сколько секунд нужно подождать
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._lock:
+            delay = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + delay)
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Токены начинают копиться только после окончания паузы
+            self._tokens = 0
+            self._updated = self._blocked_until
+            self.throttled += 1
+        logger.warning(f"{self.name} rate limited, pausing for {delay}s, rate lowered to {self.rate:.2f}/s")
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+    def budget(self):
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._tokens + max(0, now - self._updated) * self.rate)
+            return {
+                "rate": self.rate,
+                "max_rate": self.max_rate,
+                "tokens": tokens,
+                "blocked_for": max(0, self._blocked_until - now),
+                "throttled": self.throttled
+            }
+
+def parse_retry_after(value):
+    try:
+        return max(0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+# Общие для всего процесса ограничители (запросов в секунду)
+rate_limiters = {
+    "Spotify": RateLimiter("Spotify", float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))),
+    "Yandex Music": RateLimiter("Yandex Music", float(os.getenv("YANDEX_RATE_LIMIT", "5")))
+}
+
+class CircuitOpenError(Exception):
+    pass
+
+class BulkheadFullError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Размыкается после серии ошибок или слишком медленных ответов и сразу отклоняет вызовы.
+
+    Через reset_timeout пропускает один пробный вызов: успех замыкает цепь, ошибка - снова размыкает.
+    """
+
+    def __init__(self, name, failure_threshold=5, slow_call_seconds=10, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0
+        self._trial_in_flight = False
+        self._trial_started = 0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        # True, пока вызовы отклоняются: цепь разомкнута или идет пробный вызов
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                return now - self._opened_at < self.reset_timeout
+            if self.state == "half_open":
+                return self._trial_in_flight and now - self._trial_started < self.reset_timeout
+            return False
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            # Пробный вызов, завершения которого не дождались (отмена, необработанное исключение),
+            # через reset_timeout уступает место новому
+            if self.state == "half_open" and (
+                not self._trial_in_flight or now - self._trial_started >= self.reset_timeout
+            ):
+                self._trial_in_flight = True
+                self._trial_started = now
+                return
+        raise CircuitOpenError(f"{self.name} is unavailable, circuit is open")
+
+    def release_trial(self):
+        # Вызов прерван без результата: пробный слот освобождается без смены состояния
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self, latency):
+        if latency > self.slow_call_seconds:
+            self.record_failure(f"slow response {latency:.1f}s")
+            return
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"{self.name} circuit closed")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.error(f"{self.name} circuit opened after {self.failures} failures: {error}")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+class Bulkhead:
+    """Отдельный ограниченный пул потоков для вызовов одной платформы из обработчиков бота.
+
+    Если пул и очередь заняты, вызов сразу отклоняется; если ответ не пришел за timeout,
+    поток обработчика освобождается, не дожидаясь зависшего запроса.
+    """
+
+    def __init__(self, name, max_workers, max_queue=None, timeout=30):
+        self.name = name
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"bulkhead-{name}")
+        self._slots = threading.BoundedSemaphore(max_workers + (max_queue if max_queue is not None else max_workers))
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise BulkheadFullError(f"Too many concurrent {self.name} calls")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result(timeout=self.timeout)
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "10"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "60"))
+
+circuit_breakers = {
+    platform: CircuitBreaker(
+        platform,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+        reset_timeout=CIRCUIT_RESET_SECONDS
+    )
+    for platform in ("Spotify", "Yandex Music")
+}
+
+# Пулы для вызовов из обработчиков бота; сканер релизов использует свои пулы
+bulkheads = {
+    "Spotify": Bulkhead("Spotify", int(os.getenv("SPOTIFY_BULKHEAD_SIZE", "4"))),
+    "Yandex Music": Bulkhead("Yandex Music", int(os.getenv("YANDEX_BULKHEAD_SIZE", "4")))
+}
+
+class PlatformCall:
+    """Учет одного запроса к платформе в ее ограничителе скорости и предохранителе.
+
+    Вход в блок ждет токен ограничителя и сразу отказывает (CircuitOpenError), если цепь разомкнута.
+    Исход можно записать явно (record_status, record_rate_limited, ...); иначе он определяется при выходе:
+    без исключения - успех, исключение из response_errors - сервис ответил (успех),
+    из failure_errors - сбой платформы, любое другое (в том числе отмена) только освобождает пробный слот.
+
+    Использование:
+        with PlatformCall("Spotify", failure_errors=(requests.RequestException,)) as call:
+            response = session.request(method, url)
+            call.record_status(response.status_code)
+    """
+
+    def __init__(self, platform, failure_errors=(), response_errors=()):
+        self.limiter = rate_limiters[platform]
+        self.breaker = circuit_breakers[platform]
+        self.failure_errors = failure_errors
+        self.response_errors = response_errors
+        self._started = 0
+        self._recorded = False
+
+    def _start(self):
+        self.breaker.before_call()
+        self._started = time.monotonic()
+        self._recorded = False
+        return self
+
+    def __enter__(self):
+        self.limiter.acquire()
+        return self._start()
+
+    async def __aenter__(self):
+        await self.limiter.acquire_async()
+        return self._start()
+
+    def record_success(self):
+        self._recorded = True
+        self.limiter.on_success()
+        self.breaker.record_success(time.monotonic() - self._started)
+
+    def record_failure(self, error):
+        self._recorded = True
+        self.breaker.record_failure(error)
+
+    def record_rate_limited(self, retry_after=None):
+        # 429 - платформа отвечает, поэтому для предохранителя это не сбой
+        self._recorded = True
+        self.limiter.on_rate_limited(retry_after)
+        self.breaker.record_success(time.monotonic() - self._started)
+
+    def record_status(self, status, retry_after=None):
+        if status == 429:
+            self.record_rate_limited(retry_after)
+        elif status >= 500:
+            self.record_failure(f"HTTP {status}")
+        else:
+            self.record_success()
+
+    def _finish(self, error):
+        if self._recorded:
+            return
+        if error is None or isinstance(error, self.response_errors):
+            self.record_success()
+        elif isinstance(error, self.failure_errors):
+            self.record_failure(error)
+        else:
+            self._recorded = True
+            self.breaker.release_trial()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._finish(exc)
+        return False
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._finish(exc)
+        return False
+
+def platform_call(platform, fn, *args, **kwargs):
+    # Выполняет fn в пуле платформы; для неизвестной платформы - в текущем потоке
+    bulkhead = bulkheads.get(platform)
+    if bulkhead is None:
+        return fn(*args, **kwargs)
+    return bulkhead.call(fn, *args, **kwargs)
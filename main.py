@@ -7,6 +7,8 @@ import logging
 import random
 import json
 import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from database import *
 from dotenv import load_dotenv
 from telebot import types
@@ -17,8 +19,11 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from spotify_func import (
     get_spotify_token,
+    start_token_refresher,
+    spotify_request,
     search_artist,
     get_spotify_artist_info,
+    get_spotify_artists_info,
     get_spotify_last_releases,
     get_spotify_top_tracks,
     create_spotify_playlist,
@@ -26,6 +31,7 @@ from spotify_func import (
 )
 from yandex_func import (
     get_yandex_artist_info,
+    get_yandex_artists_info,
     search_yandex_artist,
     get_yandex_last_releases,
     get_yandex_top_tracks,
@@ -34,6 +40,8 @@ from yandex_func import (
     delete_old_mix,
     yandex_client
 )
+from cache import search_cache, RefreshingCache
+from limits import rate_limiters, circuit_breakers, bulkheads, platform_call, CircuitOpenError
 from flask import Flask
 import signal
 import sys
@@ -58,6 +66,53 @@ PAYMENT_INFO = """
 После оплаты отправьте скриншот или фото чека администратору: @ArmaniB
 """
 
+# Количество параллельных запросов к каждой платформе при проверке релизов
+SCAN_WORKERS = {
+    "Spotify": int(os.getenv("SPOTIFY_SCAN_WORKERS", "8")),
+    "Yandex Music": int(os.getenv("YANDEX_SCAN_WORKERS", "4"))
+}
+
+# Границы интервала опроса артиста в часах: активных артистов проверяем
+# с минимальным интервалом, давно молчащих - с максимальным
+SCAN_MIN_INTERVAL_HOURS = float(os.getenv("SCAN_MIN_INTERVAL_HOURS", "1"))
+SCAN_MAX_INTERVAL_HOURS = float(os.getenv("SCAN_MAX_INTERVAL_HOURS", "24"))
+
+# Пороги (в днях) для распределения артистов по уровням активности
+HOT_ARTIST_DAYS = 30
+WARM_ARTIST_DAYS = 180
+
+POLL_INTERVALS = {
+    "hot": SCAN_MIN_INTERVAL_HOURS * 3600,
+    "warm": (SCAN_MIN_INTERVAL_HOURS * SCAN_MAX_INTERVAL_HOURS) ** 0.5 * 3600,
+    "cold": SCAN_MAX_INTERVAL_HOURS * 3600
+}
+
+# Артисты разбиты на срезы по хэшу artist_id; каждую минуту проверяется один срез,
+# так что за минимальный интервал опроса каждый артист проверяется ровно один раз
+SCAN_SLICE_SECONDS = 60
+SCAN_SLICES = max(1, int(SCAN_MIN_INTERVAL_HOURS * 3600 // SCAN_SLICE_SECONDS))
+
+# Через сколько проверенных артистов результаты записываются в базу одной транзакцией
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "100"))
+
+# Как часто обновлять метаданные артистов в каталоге и сколько артистов обновлять за один запуск
+ARTIST_REFRESH_HOURS = float(os.getenv("ARTIST_REFRESH_HOURS", "24"))
+ARTIST_REFRESH_INTERVAL_MINUTES = 10
+ARTIST_REFRESH_LIMIT = int(os.getenv("ARTIST_REFRESH_LIMIT", "200"))
+
+# Сколько часов последние релизы из каталога считаются актуальными для кнопки "Последний релиз".
+# По умолчанию - максимальный интервал опроса: релизы артистов с подписчиками обновляет сканер
+LAST_RELEASE_TTL_HOURS = float(os.getenv("LAST_RELEASE_TTL_HOURS", str(SCAN_MAX_INTERVAL_HOURS)))
+
+# Кэш топ-треков: свежие записи - TOP_TRACKS_TTL_HOURS, после этого еще TOP_TRACKS_STALE_HOURS
+# отдаются сразу с обновлением в фоне. TOP_TRACKS_DB_CACHE=0 отключает хранение в SQLite
+TOP_TRACKS_TTL_HOURS = float(os.getenv("TOP_TRACKS_TTL_HOURS", "24"))
+TOP_TRACKS_STALE_HOURS = float(os.getenv("TOP_TRACKS_STALE_HOURS", "168"))
+TOP_TRACKS_DB_CACHE = os.getenv("TOP_TRACKS_DB_CACHE", "1") == "1"
+
+# Сколько ждать создания плейлиста с миксом (секунд)
+PLAYLIST_TIMEOUT = 120
+
 # Инициализация бота
 bot = telebot.TeleBot(TOKEN)
 
@@ -107,7 +162,7 @@ def handle_artist_info(call):
         logger.info(f"Fetching artist info for artist_id={artist_id}, platform={platform}")
 
         # Получаем информацию об артисте
-        artist_info = get_artist_info(artist_id, platform)
+        artist_info = get_catalogue_artist_info(artist_id, platform)
 
         # Проверяем, получена ли информация
         if artist_info is None:
@@ -167,6 +222,48 @@ def get_artist_info(artist_id, platform):
         logger.error(f"Unsupported platform: {platform}")
         return None
 
+def get_catalogue_artist_info(artist_id, platform):
+    # Карточка артиста из каталога; к платформе обращаемся, только если артиста там еще нет
+    artist = get_artist(platform, artist_id)
+    if artist and artist["name"]:
+        return artist
+
+    artist_info = platform_call(platform, get_artist_info, artist_id, platform)
+    if artist_info:
+        save_artists(platform, {artist_id: artist_info}, time.time())
+    return artist_info
+
+# Метаданные артистов для каталога: {artist_id: info или None}
+def get_artists_info(artist_ids, platform):
+    if platform == "Spotify":
+        return get_spotify_artists_info(artist_ids)
+    elif platform == "Yandex Music":
+        return get_yandex_artists_info(artist_ids)
+    logger.error(f"Unsupported platform: {platform}")
+    return {}
+
+# Фоновое обновление каталога: за один запуск обновляем самых давно обновленных артистов
+def refresh_artist_catalogue():
+    started = time.time()
+    stale = get_stale_artists(started - ARTIST_REFRESH_HOURS * 3600, ARTIST_REFRESH_LIMIT)
+    by_platform = {}
+    for platform, artist_id in stale:
+        by_platform.setdefault(platform, []).append(artist_id)
+
+    for platform, artist_ids in by_platform.items():
+        breaker = circuit_breakers.get(platform)
+        if breaker is not None and breaker.is_open():
+            logger.warning(f"{platform} circuit is open, skipping catalogue refresh")
+            continue
+        try:
+            artists = get_artists_info(artist_ids, platform)
+            save_artists(platform, artists, time.time())
+            logger.info(
+                f"Refreshed {sum(1 for info in artists.values() if info)} of {len(artist_ids)} {platform} artists"
+            )
+        except Exception as e:
+            logger.error(f"Error in refresh_artist_catalogue ({platform}): {e}", exc_info=True)
+
 def format_artist_info(artist_info):
     if artist_info:
         return (
@@ -184,7 +281,7 @@ def test_spotify_artist(artist_id):
         return
     url = f"https://api.spotify.com/v1/artists/{artist_id}"
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+    response = spotify_request("GET", url, headers=headers)
     if response.status_code == 200:
         print("Артист найден на Spotify.")
     else:
@@ -210,7 +307,7 @@ def check_spotify_token():
 
     url = "https://api.spotify.com/v1/me"
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+    response = spotify_request("GET", url, headers=headers)
     if response.status_code == 200:
         print("Токен Spotify действителен.")
         return True
@@ -247,20 +344,64 @@ def handle_unsubscribe(call):
 
 
 
+top_tracks_cache = RefreshingCache(
+    maxsize=4096,
+    ttl=TOP_TRACKS_TTL_HOURS * 3600,
+    stale_ttl=TOP_TRACKS_STALE_HOURS * 3600,
+    load=load_top_tracks if TOP_TRACKS_DB_CACHE else None,
+    save=save_top_tracks if TOP_TRACKS_DB_CACHE else None
+)
+
+def get_top_tracks(artist_id, platform):
+    if platform == "Spotify":
+        fetch = get_spotify_top_tracks
+    elif platform == "Yandex Music":
+        fetch = get_yandex_top_tracks
+    else:
+        logger.error(f"Unsupported platform: {platform}")
+        return None
+    return top_tracks_cache.get((platform, artist_id), lambda: platform_call(platform, fetch, artist_id))
+
+def get_stored_last_releases(artist_id, platform):
+    # Последние релизы из каталога, который обновляет сканер; к платформе обращаемся,
+    # только если записи нет или она старше LAST_RELEASE_TTL_HOURS
+    artist = get_artist(platform, artist_id)
+    checked_at = artist["releases_checked_at"] if artist else None
+    stored = (artist["latest_album"], artist["latest_single"]) if artist else (None, None)
+    if checked_at and time.time() - checked_at < LAST_RELEASE_TTL_HOURS * 3600:
+        return stored
+
+    try:
+        album, single = platform_call(platform, get_last_releases, artist_id, platform)
+    except Exception as e:
+        # Платформа недоступна - лучше показать устаревшие данные, чем ошибку
+        if not checked_at:
+            raise
+        logger.warning(f"Serving stale releases for {artist_id} ({platform}): {e}")
+        return stored
+
+    if not album and not single:
+        return stored
+    save_artist_releases(platform, artist_id, album, single, time.time())
+    return album, single
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("last_release:"))
 def handle_last_release(call):
     # Разбираем callback_data
     _, artist_id, platform = call.data.split(":")
 
-    # Получаем последние релизы
-    if platform == "Spotify":
-        album, single = get_spotify_last_releases(artist_id)
-    elif platform == "Yandex Music":
-        album, single = get_yandex_last_releases(artist_id)
-    else:
+    if platform not in ("Spotify", "Yandex Music"):
         bot.answer_callback_query(call.id, "❌ Платформа не поддерживается.")
         return
 
+    # Получаем последние релизы
+    try:
+        album, single = get_stored_last_releases(artist_id, platform)
+    except Exception as e:
+        logger.error(f"Error in handle_last_release: {e}")
+        bot.answer_callback_query(call.id, f"❌ {platform} сейчас недоступен, попробуйте позже.")
+        return
+
     # Формируем сообщение
     message_text = "🎵 Последние релизы:\n\n"
 
@@ -302,7 +443,7 @@ def get_new_releases(artist_id):
     url = f"https://api.spotify.com/v1/artists/{artist_id}/albums"
     headers = {"Authorization": f"Bearer {token}"}
     params = {"limit": 5, "include_groups": "album,single"}  # Последние 5 альбомов/синглов
-    response = requests.get(url, headers=headers, params=params)
+    response = spotify_request("GET", url, headers=headers, params=params)
     return response.json().get("items", [])
 
 
@@ -334,9 +475,10 @@ def handle_platform_choice(call):
         _, platform, artist_name = call.data.split(":", 2)
         chat_id = call.message.chat.id
         
-        if not can_add_subscription(chat_id):
-            vip_level = get_vip_level(chat_id)
-            max_subs = get_max_subscriptions(chat_id)
+        profile = get_user_profile(chat_id)
+        if profile["subscriptions"] >= profile["max_subscriptions"]:
+            vip_level = profile["vip_level"]
+            max_subs = profile["max_subscriptions"]
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="menu_subscriptions"))
             bot.answer_callback_query(call.id)
@@ -354,7 +496,7 @@ def handle_platform_choice(call):
         markup = types.InlineKeyboardMarkup(row_width=1)
 
         if platform == "Spotify":
-            result = search_artist(artist_name)
+            result = platform_call(platform, search_artist, artist_name)
             if result.get("artists", {}).get("items"):
                 artists = result["artists"]["items"][:5]  # Limit to top 5 results
                 for i, artist in enumerate(artists):
@@ -382,12 +524,13 @@ def handle_platform_choice(call):
                 )
                 return
         elif platform == "Yandex Music":
-            artists = search_yandex_artist(artist_name)[:5]  # Limit to top 5 results
+            artists = platform_call(platform, search_yandex_artist, artist_name)[:5]  # Limit to top 5 results
             if artists:
                 for i, artist in enumerate(artists):
                     # Сокращаем имя артиста если оно слишком длинное
                     display_name = artist.name[:20] + "..." if len(artist.name) > 20 else artist.name
-                    tracks_count = len(artist.get_tracks()) if artist.get_tracks() else 0
+                    # Количество треков уже есть в результатах поиска, отдельные запросы не нужны
+                    tracks_count = artist.counts.tracks if artist.counts and artist.counts.tracks else 0
                     button_text = f"{display_name} ({tracks_count:,} тр.)"
                     
                     # Create a shorter callback_data using index
@@ -432,16 +575,9 @@ def handle_artist_selection(call):
         # Convert platform code to full name
         platform = "Spotify" if platform_code == "sa" else "Yandex Music"
         
-        # Get artist name based on platform
-        if platform == "Spotify":
-            token = get_spotify_token()
-            headers = {"Authorization": f"Bearer {token}"}
-            response = requests.get(f"https://api.spotify.com/v1/artists/{artist_id}", headers=headers)
-            artist_data = response.json()
-            artist_name = artist_data.get('name', 'Unknown Artist')
-        else:  # Yandex Music
-            artist = yandex_client.artists(artist_id)[0]
-            artist_name = artist.name
+        # Имя артиста берем из каталога, при его отсутствии - у платформы
+        artist_info = get_catalogue_artist_info(artist_id, platform)
+        artist_name = artist_info['name'] if artist_info else 'Unknown Artist'
         
         if has_subscription(chat_id, artist_id):
             markup = types.InlineKeyboardMarkup()
@@ -454,8 +590,23 @@ def handle_artist_selection(call):
                 reply_markup=markup
             )
             return
+
+        # Лимит мог быть исчерпан после показа списка артистов (например, из другого сообщения)
+        if not can_add_subscription(chat_id):
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="menu_subscriptions"))
+            bot.answer_callback_query(call.id)
+            bot.edit_message_text(
+                "❌ Достигнут лимит подписок!\n"
+                "Повысьте уровень для увеличения лимита.",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=markup
+            )
+            return
             
         add_subscription(chat_id, artist_id, artist_name, platform=platform)
+        profile = get_user_profile(chat_id)
         
         # Format artist URL
         if platform == "Spotify":
@@ -470,7 +621,7 @@ def handle_artist_selection(call):
         bot.edit_message_text(
             f"🎤 Теперь ты следишь за {artist_name} на {platform}!\n"
             f"Ссылка: {artist_url}\n\n"
-            f"Подписок: {len(get_subscriptions(chat_id))}/{get_max_subscriptions(chat_id)}",
+            f"Подписок: {profile['subscriptions']}/{profile['max_subscriptions']}",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
@@ -534,99 +685,378 @@ def unmute_notifications(message):
     unmute_user(message.from_user.id)
     bot.reply_to(message, "🔔 Уведомления включены. Используй /mute, чтобы отключить их.")
 
+# Получение последних релизов артиста на нужной платформе
+def get_last_releases(artist_id, platform):
+    if platform == "Spotify":
+        return get_spotify_last_releases(artist_id)
+    elif platform == "Yandex Music":
+        return get_yandex_last_releases(artist_id)
+    else:
+        logger.error(f"Unsupported platform: {platform}")
+        return None, None
+
+def format_release_message(artist_name, platform, release, release_type):
+    kind = "альбом" if release_type == "album" else "сингл"
+    where = " в Яндекс.Музыке" if platform == "Yandex Music" else ""
+    return (
+        f"🎵 Новый {kind} от {artist_name}{where}!\n"
+        f"Название: {release['name']}\n"
+        f"Дата выхода: {release['release_date']}\n"
+        f"Ссылка: {release['link']}"
+    )
+
+# Рассылаем найденные релизы артиста всем его подписчикам.
+# Возвращает True, если среди них был ранее неизвестный релиз
+# Новые релизы и уведомления добавляются в batch; в базу они попадают при flush_scan_batch
+def notify_subscribers(artist_id, platform, subscribers, album, single, batch):
+    recorded = set()
+    detected = False
+
+    for chat_id, artist_name, subscription_date in subscribers:
+        try:
+            # Альбом проверяем первым: если он вышел, сингл пропускаем
+            for release, release_type in ((album, 'album'), (single, 'single')):
+                if not release or not isinstance(release, dict):
+                    continue
+
+                release_date = release.get('release_date')
+                if not release_date or release_date == "N/A" or release_date <= (subscription_date or ""):
+                    continue
+
+                release_id = str(release['id'])
+                if release_id not in recorded:
+                    if not is_release_known(artist_id, platform, release_id):
+                        batch["releases"].append((artist_id, platform, release_id, release_type, release_date))
+                        detected = True
+                    recorded.add(release_id)
+
+                # Ставим уведомление в очередь и сдвигаем дату подписки на дату выхода релиза
+                batch["notifications"].append((
+                    chat_id,
+                    artist_id,
+                    release_date,
+                    format_release_message(artist_name, platform, release, release_type)
+                ))
+                break
+
+        except Exception as e:
+            logger.error(f"Error notifying {chat_id} about {artist_name}: {e}", exc_info=True)
+            continue
+
+    return detected
+
+# Состояние опроса артистов: {(platform, artist_id): {"last_checked", "latest_release", "hot_until"}}.
+# Хранится в базе, поэтому после перезапуска уже проверенные артисты не запрашиваются повторно
+artist_poll_state = load_artist_poll_state()
+
+def parse_release_date(value):
+    # Spotify отдает YYYY, YYYY-MM или YYYY-MM-DD, Яндекс - дату в формате ISO
+    if not value or value == "N/A":
+        return None
+    value = str(value)[:10]
+    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def get_artist_tier(key, cadence, now):
+    state = artist_poll_state.get(key, {})
+    if state.get("hot_until", 0) > now:
+        return "hot"
+
+    # Дата последнего релиза: из последней проверки или из истории релизов
+    dates = [parse_release_date(state.get("latest_release"))]
+    gap = None
+    if key in cadence:
+        count, first_date, last_date = cadence[key]
+        first_date, last_date = parse_release_date(first_date), parse_release_date(last_date)
+        dates.append(last_date)
+        # Средний промежуток между релизами
+        if count > 1 and first_date and last_date:
+            gap = (last_date - first_date).days / (count - 1)
+
+    dates = [date for date in dates if date]
+    if not dates:
+        return "cold"
+
+    # Частота релизов только расширяет окно "недавности" до двух обычных промежутков между релизами:
+    # давно замолчавший артист не станет активным из-за того, как часто выпускал релизы раньше
+    days_since = (datetime.fromtimestamp(now) - max(dates)).days
+    for tier, tier_days in (("hot", HOT_ARTIST_DAYS), ("warm", WARM_ARTIST_DAYS)):
+        window = tier_days
+        if gap is not None and gap <= tier_days:
+            window = max(tier_days, 2 * gap)
+        if days_since <= window:
+            return tier
+    return "cold"
+
+# Выбираем артистов, у которых подошло время проверки согласно их уровню активности.
+# artist_times: {(platform, artist_id): время среза, в который проверяется артист}
+def get_due_artists(artist_times):
+    cadence = get_release_cadence(artist_times)
+    due = []
+    tiers = {"hot": 0, "warm": 0, "cold": 0}
+
+    for key, now in artist_times.items():
+        state = artist_poll_state.get(key)
+        if state is None:
+            # Артиста еще не проверяли
+            due.append(key)
+            continue
+
+        tier = get_artist_tier(key, cadence, now)
+        tiers[tier] += 1
+        if now - state["last_checked"] >= POLL_INTERVALS[tier]:
+            due.append(key)
+
+    logger.info(f"Artist tiers: {tiers}, due for check: {len(due)}")
+    return due
+
+def update_poll_state(key, album, single, detected, now, batch):
+    # Запоминаем состояние до изменения, чтобы откатить его, если пачку не удастся записать
+    if key not in batch["previous_states"]:
+        previous = artist_poll_state.get(key)
+        batch["previous_states"][key] = dict(previous) if previous is not None else None
+    state = artist_poll_state.setdefault(key, {"latest_release": None, "hot_until": 0})
+    state["last_checked"] = now
+
+    release_dates = [
+        release.get('release_date') for release in (album, single)
+        if release and isinstance(release, dict) and parse_release_date(release.get('release_date'))
+    ]
+    if release_dates:
+        state["latest_release"] = max(release_dates, key=parse_release_date)
+
+    # Найден новый релиз - снова опрашиваем артиста с максимальной частотой
+    if detected:
+        state["hot_until"] = now + HOT_ARTIST_DAYS * 86400
+
+    platform, artist_id = key
+    batch["poll_states"].append(
+        (platform, artist_id, state["last_checked"], state["latest_release"], state["hot_until"])
+    )
+    # Вызывается только для артистов, по которым платформа ответила (ошибки пробы пропускают артиста
+    # в fetch_releases_concurrently). Если релизов нет совсем, последние релизы в каталоге не трогаем
+    if album or single:
+        batch["artist_releases"].append((platform, artist_id, album, single, now))
+
+def new_scan_batch():
+    return {
+        "releases": [],
+        "notifications": [],
+        "poll_states": [],
+        "artist_releases": [],
+        "previous_states": {}
+    }
+
+# Записывает пачку в базу. Возвращает False, если запись не удалась: тогда состояние опроса
+# артистов пачки в памяти откатывается, и они будут проверены заново
+def flush_scan_batch(batch):
+    saved = True
+    if batch["poll_states"]:
+        saved = save_scan_results(
+            batch["releases"],
+            batch["notifications"],
+            batch["poll_states"],
+            batch["artist_releases"]
+        )
+    if not saved:
+        for key, previous in batch["previous_states"].items():
+            if previous is None:
+                artist_poll_state.pop(key, None)
+            else:
+                artist_poll_state[key] = previous
+        logger.error(f"Scan results for {len(batch['previous_states'])} artists were not saved, they will be checked again")
+    batch.update(new_scan_batch())
+    return saved
+
+# Отдельный пул потоков на каждую платформу, чтобы медленная платформа не тормозила другую
+scan_executors = {
+    platform: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"scan-{platform}")
+    for platform, workers in SCAN_WORKERS.items()
+}
+
+# Параллельно запрашиваем релизы и отдаем результаты по мере готовности.
+# Запись в базу и уведомления выполняются в вызывающем потоке
+def fetch_releases_concurrently(artist_keys):
+    futures = {}
+    skipped = {}
+    for platform, artist_id in artist_keys:
+        executor = scan_executors.get(platform)
+        if executor is None:
+            logger.error(f"Unsupported platform: {platform}")
+            continue
+        # Платформа недоступна - не ставим запросы в очередь, артисты будут проверены позже
+        breaker = circuit_breakers.get(platform)
+        if breaker is not None and breaker.is_open():
+            skipped[platform] = skipped.get(platform, 0) + 1
+            continue
+        futures[executor.submit(get_last_releases, artist_id, platform)] = (platform, artist_id)
+
+    for platform, count in skipped.items():
+        logger.warning(f"{platform} circuit is open, skipped {count} artists")
+
+    for future in as_completed(futures):
+        platform, artist_id = futures[future]
+        # Артист, для которого не получен ответ, не считается проверенным и будет запрошен снова
+        try:
+            yield (platform, artist_id), future.result()
+        except CircuitOpenError as e:
+            # Предохранитель разомкнулся уже во время прохода - это не ошибка в коде, трассировка не нужна
+            logger.warning(f"Skipped {artist_id} ({platform}): {e}")
+        except Exception as e:
+            logger.error(f"Error fetching releases for {artist_id} ({platform}): {e}", exc_info=True)
+
+# Диапазон 32-битного хэша делится на SCAN_SLICES равных частей: срез - непрерывный диапазон scan_hash,
+# поэтому подписки среза выбираются из базы по индексу
+SCAN_HASH_SPACE = 2 ** 32
+
+def get_artist_slice(key):
+    platform, artist_id = key
+    return get_scan_hash(platform, artist_id) * SCAN_SLICES // SCAN_HASH_SPACE
+
+def get_slice_hash_ranges(slices):
+    # Соседние срезы объединяются в один диапазон [low, high) значений scan_hash
+    ranges = []
+    for slice_number in sorted(slices):
+        low = -(-slice_number * SCAN_HASH_SPACE // SCAN_SLICES)
+        high = -(-(slice_number + 1) * SCAN_HASH_SPACE // SCAN_SLICES)
+        if ranges and ranges[-1][1] == low:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((low, high))
+    return ranges
+
+# Номер последнего полностью обработанного минутного среза; хранится в базе,
+# чтобы после перезапуска догнать пропущенные срезы, а не начинать заново
+last_scanned_tick = get_scan_state("last_tick")
+last_scanned_tick = int(last_scanned_tick) if last_scanned_tick is not None else None
+
 # Функция для проверки новых релизов
 def check_new_releases():
-    conn, cursor = get_db()
-    # Получаем всех пользователей и их подписки
-    cursor.execute("SELECT chat_id FROM users WHERE muted = FALSE")
-    users = cursor.fetchall()
-    
-    for user in users:
-        chat_id = user[0]
-        subscriptions = get_subscriptions(chat_id)
-        
-        for artist_id, artist_name, platform, subscription_date in subscriptions:
-            try:
-                if platform == "Spotify":
-                    album, single = get_spotify_last_releases(artist_id)
-                    
-                    # Проверяем альбом
-                    if album and isinstance(album, dict):
-                        album_date = album.get('release_date')
-                        if album_date and album_date > subscription_date:
-                            if add_release_to_history(artist_id, platform, album['id'], 'album', album_date):
-                                message = (
-                                    f"🎵 Новый альбом от {artist_name}!\n"
-                                    f"Название: {album['name']}\n"
-                                    f"Дата выхода: {album_date}\n"
-                                    f"Ссылка: {album['link']}"
-                                )
-                                bot.send_message(chat_id, message)
-                                # Обновляем дату подписки на дату выхода альбома
-                                update_subscription_date(chat_id, artist_id, album_date)
-                                continue  # Пропускаем проверку сингла, если вышел альбом
-                    
-                    # Проверяем сингл только если не было альбома
-                    if single and isinstance(single, dict):
-                        single_date = single.get('release_date')
-                        if single_date and single_date > subscription_date:
-                            if add_release_to_history(artist_id, platform, single['id'], 'single', single_date):
-                                message = (
-                                    f"🎵 Новый сингл от {artist_name}!\n"
-                                    f"Название: {single['name']}\n"
-                                    f"Дата выхода: {single_date}\n"
-                                    f"Ссылка: {single['link']}"
-                                )
-                                bot.send_message(chat_id, message)
-                                # Обновляем дату подписки на дату выхода сингла
-                                update_subscription_date(chat_id, artist_id, single_date)
-                        
-                elif platform == "Yandex Music":
-                    album, single = get_yandex_last_releases(artist_id)
-                    
-                    # Проверяем альбом
-                    if album and isinstance(album, dict):
-                        album_date = album.get('release_date')
-                        if album_date and album_date > subscription_date:
-                            if add_release_to_history(artist_id, platform, str(album['id']), 'album', album_date):
-                                message = (
-                                    f"🎵 Новый альбом от {artist_name} в Яндекс.Музыке!\n"
-                                    f"Название: {album['name']}\n"
-                                    f"Дата выхода: {album_date}\n"
-                                    f"Ссылка: {album['link']}"
-                                )
-                                bot.send_message(chat_id, message)
-                                # Обновляем дату подписки на дату выхода альбома
-                                update_subscription_date(chat_id, artist_id, album_date)
-                                continue  # Пропускаем проверку сингла, если вышел альбом
-                    
-                    # Проверяем сингл только если не было альбома
-                    if single and isinstance(single, dict):
-                        single_date = single.get('release_date')
-                        if single_date and single_date > subscription_date:
-                            if add_release_to_history(artist_id, platform, str(single['id']), 'single', single_date):
-                                message = (
-                                    f"🎵 Новый сингл от {artist_name} в Яндекс.Музыке!\n"
-                                    f"Название: {single['name']}\n"
-                                    f"Дата выхода: {single_date}\n"
-                                    f"Ссылка: {single['link']}"
-                                )
-                                bot.send_message(chat_id, message)
-                                # Обновляем дату подписки на дату выхода сингла
-                                update_subscription_date(chat_id, artist_id, single_date)
-                            
-            except Exception as e:
-                logger.error(f"Error checking releases for {artist_name}: {e}", exc_info=True)
-                continue
+    global last_scanned_tick
+    started = time.time()
+    current_tick = int(started // SCAN_SLICE_SECONDS)
+
+    # Если проход затянулся и минуты были пропущены, догоняем пропущенные срезы
+    if last_scanned_tick is None:
+        first_tick = current_tick
+    else:
+        first_tick = max(last_scanned_tick + 1, current_tick - SCAN_SLICES + 1)
+    if first_tick > current_tick:
+        return
+
+    slice_ticks = {tick % SCAN_SLICES: tick for tick in range(first_tick, current_tick + 1)}
+
+    # Из базы загружаются только подписки артистов текущих срезов.
+    # Каждый артист запрашивается один раз за проход, результат раздается всем подписчикам
+    artists = get_artist_subscribers(get_slice_hash_ranges(slice_ticks))
+    # Время проверки считаем по началу среза, чтобы интервалы опроса не "плыли"
+    artist_times = {
+        key: slice_ticks[get_artist_slice(key)] * SCAN_SLICE_SECONDS
+        for key in artists
+    }
+    due_artists = get_due_artists(artist_times)
+    logger.info(
+        f"Checking releases for {len(due_artists)} of {len(artist_times)} artists "
+        f"in slices {sorted(slice_ticks)}"
+    )
+
+    batch = new_scan_batch()
+    saved = True
+    for (platform, artist_id), (album, single) in fetch_releases_concurrently(due_artists):
+        key = (platform, artist_id)
+        try:
+            detected = notify_subscribers(artist_id, platform, artists[key], album, single, batch)
+            update_poll_state(key, album, single, detected, artist_times[key], batch)
+        except Exception as e:
+            logger.error(f"Error checking releases for {artist_id} ({platform}): {e}", exc_info=True)
+            continue
+
+        if len(batch["poll_states"]) >= SCAN_BATCH_SIZE:
+            saved = flush_scan_batch(batch) and saved
+    saved = flush_scan_batch(batch) and saved
+
+    # Если часть результатов не записана, срезы не считаются пройденными: следующий запуск
+    # повторит их, и артисты с откаченным состоянием будут проверены снова
+    if saved:
+        last_scanned_tick = current_tick
+        set_scan_state("last_tick", current_tick)
+    logger.info(f"Release check finished in {time.time() - started:.1f}s")
+
+# Ограничения Telegram: около 30 сообщений в секунду всего и 1 сообщение в секунду в один чат
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_INTERVAL = 1.0
+NOTIFICATION_MAX_ATTEMPTS = 5
+
+# Время последней отправки в каждый чат
+last_sent_per_chat = {}
+
+# Уведомления, которые уже доставлены, но не отмечены в базе: повторно их не отправляем
+unmarked_sent = set()
+
+# Отправляем очередную порцию уведомлений из очереди.
+# Возвращает количество обработанных уведомлений (пропущенные из-за лимита чата не считаются)
+def send_pending_notifications():
+    for notification_id in list(unmarked_sent):
+        if mark_notification_sent(notification_id):
+            unmarked_sent.discard(notification_id)
+
+    notifications = get_pending_notifications(time.time(), TELEGRAM_GLOBAL_RATE)
+    processed = 0
+
+    for notification_id, chat_id, message in notifications:
+        started = time.time()
+        if notification_id in unmarked_sent:
+            continue
+        if started - last_sent_per_chat.get(chat_id, 0) < TELEGRAM_CHAT_INTERVAL:
+            continue
+
+        processed += 1
+        try:
+            bot.send_message(chat_id, message)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429:
+                # Telegram просит подождать: откладываем сообщение и останавливаем отправку
+                retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 5)
+                logger.warning(f"Telegram rate limit hit, retry after {retry_after}s")
+                defer_notification(notification_id, time.time() + retry_after)
+                time.sleep(retry_after)
+                break
+            elif e.error_code in (400, 403):
+                # Бот заблокирован или чат не найден - повторять бессмысленно
+                logger.warning(f"Dropping notification {notification_id} for chat {chat_id}: {e}")
+                mark_notification_failed(notification_id, e)
+            else:
+                logger.error(f"Telegram error sending notification {notification_id}: {e}")
+                reschedule_notification(notification_id, time.time() + 60, e, NOTIFICATION_MAX_ATTEMPTS)
+        except Exception as e:
+            logger.error(f"Error sending notification {notification_id}: {e}")
+            reschedule_notification(notification_id, time.time() + 60, e, NOTIFICATION_MAX_ATTEMPTS)
+        else:
+            last_sent_per_chat[chat_id] = time.time()
+            # Сообщение уже доставлено: ошибка записи в базу не должна приводить к повторной отправке
+            if not mark_notification_sent(notification_id):
+                unmarked_sent.add(notification_id)
+
+        # Выдерживаем общий лимит отправки
+        elapsed = time.time() - started
+        if elapsed < 1 / TELEGRAM_GLOBAL_RATE:
+            time.sleep(1 / TELEGRAM_GLOBAL_RATE - elapsed)
+
+    return processed
 
-# Запускаем проверку каждый час
-schedule.every(1).hours.do(check_new_releases)
+# Каждую минуту проверяем очередной срез артистов
+schedule.every(SCAN_SLICE_SECONDS).seconds.do(check_new_releases)
+schedule.every(ARTIST_REFRESH_INTERVAL_MINUTES).minutes.do(refresh_artist_catalogue)
 
 def show_main_menu(chat_id, message_text="Выберите действие:", reply_to_message_id=None):
     try:
-        vip_level = get_vip_level(chat_id)
-        current_subs = len(get_subscriptions(chat_id))
-        max_subs = get_max_subscriptions(chat_id)
+        profile = get_user_profile(chat_id)
+        current_subs = profile["subscriptions"]
+        max_subs = profile["max_subscriptions"]
         
         status_text = (
             f"📝 Подписки: {current_subs}/{max_subs}\n\n"
@@ -702,9 +1132,10 @@ def handle_menu(call):
             
             markup.add(history_btn, back_btn)
             
+            profile = get_user_profile(call.from_user.id)
             message_text = (
-                f"💫 Уровень: {get_vip_level(call.from_user.id)}\n"
-                f"📝 Доступно слотов: {get_max_subscriptions(call.from_user.id)}\n\n"
+                f"💫 Уровень: {profile['vip_level']}\n"
+                f"📝 Доступно слотов: {profile['max_subscriptions']}\n\n"
                 "Выберите количество слотов для покупки:"
             )
             
@@ -714,7 +1145,7 @@ def handle_menu(call):
             markup = types.InlineKeyboardMarkup(row_width=1)
 
             # Проверяем статус уведомлений пользователя
-            is_user_muted = is_muted(call.message.chat.id)
+            is_user_muted = get_user_profile(call.message.chat.id)["muted"]
 
             # Показываем только релевантную кнопку
             if is_user_muted:
@@ -897,15 +1328,13 @@ def handle_top_tracks(call):
     try:
         _, artist_id, platform = call.data.split(":")
         
-        # Получаем топ треков
-        if platform == "Spotify":
-            tracks = get_spotify_top_tracks(artist_id)
-        elif platform == "Yandex Music":
-            tracks = get_yandex_top_tracks(artist_id)
-        else:
+        if platform not in ("Spotify", "Yandex Music"):
             bot.answer_callback_query(call.id, "❌ Платформа не поддерживается.")
             return
 
+        # Получаем топ треков
+        tracks = get_top_tracks(artist_id, platform)
+
         if not tracks:
             bot.answer_callback_query(call.id, "❌ Не удалось получить топ треков.")
             return
@@ -1009,9 +1438,10 @@ def handle_balance_menu(call):
             
             markup.add(history_btn, back_btn)
             
+            profile = get_user_profile(call.from_user.id)
             message_text = (
-                f"💫 Уровень: {get_vip_level(call.from_user.id)}\n"
-                f"📝 Доступно слотов: {get_max_subscriptions(call.from_user.id)}\n\n"
+                f"💫 Уровень: {profile['vip_level']}\n"
+                f"📝 Доступно слотов: {profile['max_subscriptions']}\n\n"
                 "Выберите количество слотов для покупки:"
             )
             
@@ -1168,6 +1598,52 @@ def show_pending_payments(message):
             )
             bot.send_message(message.chat.id, message_text, reply_markup=markup)
 
+@bot.message_handler(commands=["cache_stats"])
+def show_cache_stats(message):
+    if message.from_user.id != ADMIN_ID:
+        bot.reply_to(message, "❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    caches = {
+        "Поиск артистов": search_cache,
+        "Топ-треки": top_tracks_cache
+    }
+
+    message_text = "📊 Статистика кэшей:\n\n"
+    for name, cache in caches.items():
+        stats = cache.stats()
+        message_text += (
+            f"{name}: {stats['size']} записей\n"
+            f"Попадания: {stats['hits']}, промахи: {stats['misses']} "
+            f"({stats['hit_rate']:.0%})\n"
+        )
+        if "stale_hits" in stats:
+            message_text += (
+                f"Из них устаревших: {stats['stale_hits']}, "
+                f"обновлено в фоне: {stats['refreshes']}\n"
+            )
+        message_text += "\n"
+
+    bot.reply_to(message, message_text)
+
+@bot.message_handler(commands=["limits"])
+def show_rate_limits(message):
+    if message.from_user.id != ADMIN_ID:
+        bot.reply_to(message, "❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    message_text = "🚦 Лимиты запросов:\n\n"
+    for platform, limiter in rate_limiters.items():
+        budget = limiter.budget()
+        message_text += (
+            f"{platform}: {budget['rate']:.1f}/{budget['max_rate']:.1f} запр./с\n"
+            f"Доступно сейчас: {budget['tokens']:.1f}, пауза: {budget['blocked_for']:.0f} с\n"
+            f"Ответов 429: {budget['throttled']}\n"
+            f"Предохранитель: {circuit_breakers[platform].state}\n\n"
+        )
+
+    bot.reply_to(message, message_text)
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith(("approve_payment:", "reject_payment:")))
 def handle_payment_action(call):
     if call.from_user.id != ADMIN_ID:
@@ -1427,18 +1903,18 @@ def handle_mix_platform(call):
         tracks_per_artist = {}  # Словарь для хранения треков каждого артиста
         
         for artist_id, artist_name, _ in platform_subscriptions:
-            tracks = None
-            if platform == "Spotify":
-                tracks = get_spotify_top_tracks(artist_id)
-            elif platform == "Yandex Music":  # Добавляем обработку Яндекс.Музыки
-                tracks = get_yandex_top_tracks(artist_id)
+            try:
+                tracks = get_top_tracks(artist_id, platform)
+            except Exception as e:
+                # Платформа не ответила для этого артиста - собираем микс без него
+                logger.warning(f"Skipping {artist_name} in mix: {e}")
+                continue
             
             if tracks:
-                # Добавляем имя исполнителя к каждому треку
+                # Добавляем имя исполнителя к каждому треку (копируем, чтобы не менять записи кэша)
                 artist_tracks = []
                 for track in tracks:
-                    track['artist'] = artist_name
-                    artist_tracks.append(track)
+                    artist_tracks.append(dict(track, artist=artist_name))
                 tracks_per_artist[artist_name] = artist_tracks
         
         if not tracks_per_artist:
@@ -1479,13 +1955,16 @@ def handle_mix_platform(call):
         if platform == "Yandex Music":
             try:
                 # Сначала удаляем старый микс
-                delete_old_mix(call.from_user.id, call.from_user.first_name)
+                bulkheads[platform].submit(
+                    delete_old_mix, call.from_user.id, call.from_user.first_name
+                ).result(timeout=PLAYLIST_TIMEOUT)
                 
                 # Создаем новый плейлист
-                playlist_link = create_yandex_playlist(
+                playlist_link = bulkheads[platform].submit(
+                    create_yandex_playlist,
                     selected_tracks,
                     f"Микс для {call.from_user.first_name}"
-                )
+                ).result(timeout=PLAYLIST_TIMEOUT)
                 if playlist_link:
                     # Заменяем ID на username в ссылке
                     playlist_link = playlist_link.replace("421035053", "baloyan.dedpool")
@@ -1495,7 +1974,9 @@ def handle_mix_platform(call):
                 logger.error(f"Error in Yandex Music playlist creation: {e}")
         elif platform == "Spotify":
             try:
-                playlist_link = create_spotify_playlist(selected_tracks, call.from_user.first_name)
+                playlist_link = bulkheads[platform].submit(
+                    create_spotify_playlist, selected_tracks, call.from_user.first_name
+                ).result(timeout=PLAYLIST_TIMEOUT)
                 if not playlist_link:
                     logger.error("Failed to create Spotify playlist")
             except Exception as e:
@@ -1590,6 +2071,9 @@ if __name__ == "__main__":
     # Запускаем Flask в отдельном потоке
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()
+
+    # Держим токен Spotify актуальным в фоне
+    start_token_refresher()
     
     def run_bot():
         while True:
@@ -1635,12 +2119,23 @@ if __name__ == "__main__":
                 logger.error(f"Ошибка планировщика: {e}")
                 time.sleep(10)
     
-    # Запускаем бота и планировщик в отдельных потоках
+    def run_notification_sender():
+        while True:
+            try:
+                if not send_pending_notifications():
+                    time.sleep(1)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомлений: {e}")
+                time.sleep(10)
+    
+    # Запускаем бота, планировщик и отправку уведомлений в отдельных потоках
     bot_thread = threading.Thread(target=run_bot, daemon=True)
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    sender_thread = threading.Thread(target=run_notification_sender, daemon=True)
     
     bot_thread.start()
     scheduler_thread.start()
+    sender_thread.start()
     
     # Держим главный поток активным
     try:
@@ -1655,5 +2150,9 @@ if __name__ == "__main__":
                 logger.error("Поток планировщика остановлен, перезапуск...")
                 scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
                 scheduler_thread.start()
+            if not sender_thread.is_alive():
+                logger.error("Поток отправки уведомлений остановлен, перезапуск...")
+                sender_thread = threading.Thread(target=run_notification_sender, daemon=True)
+                sender_thread.start()
     except KeyboardInterrupt:
         logger.info("Бот останавливается...")
\ No newline at end of file
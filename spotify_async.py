@@ -0,0 +1,249 @@
+import os
+import asyncio
+import logging
+import aiohttp
+import spotify_func
+from cache import search_cache, normalize_query
+from limits import PlatformCall, parse_retry_after
+from spotify_func import (
+    ARTISTS_BATCH_SIZE,
+    SPOTIFY_RELEASES_PAGE_SIZE,
+    SPOTIFY_RATE_LIMIT_RETRIES,
+    SPOTIFY_MAX_RETRY_AFTER,
+    SpotifyAPIError,
+    get_spotify_token,
+    _format_spotify_artist,
+    _format_spotify_release,
+    _format_spotify_tracks,
+    _newest_release
+)
+
+logger = logging.getLogger(__name__)
+
+# Адрес API можно переопределить, например, чтобы гонять клиент против локальной заглушки
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+# Сколько запросов к Spotify может выполняться одновременно
+SPOTIFY_ASYNC_CONCURRENCY = int(os.getenv("SPOTIFY_ASYNC_CONCURRENCY", "100"))
+
+async def default_token_provider():
+    # Используем общий кэш токена из spotify_func; обновление (блокирующее) - в отдельном потоке
+    if spotify_func._is_token_fresh():
+        return spotify_func._cached_token[0]
+    return await asyncio.to_thread(get_spotify_token)
+
+class AsyncSpotifyClient:
+    """Асинхронный клиент Spotify: общий пул соединений и ограничение числа запросов в полете.
+
+    Использование:
+        async with AsyncSpotifyClient() as client:
+            album, single = await client.get_last_releases(artist_id)
+    """
+
+    def __init__(self, api_url=SPOTIFY_API_URL, concurrency=SPOTIFY_ASYNC_CONCURRENCY,
+                 token_provider=default_token_provider):
+        self.api_url = api_url.rstrip("/")
+        self.concurrency = concurrency
+        self.token_provider = token_provider
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=20, connect=5)
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, path, **kwargs):
+        # Возвращает (status, json или None)
+        await self.open()
+        token = await self.token_provider()
+        headers = kwargs.pop("headers", {})
+        headers["Authorization"] = f"Bearer {token}"
+        url = path if path.startswith("http") else f"{self.api_url}{path}"
+
+        async with self._semaphore:
+            for attempt in range(SPOTIFY_RATE_LIMIT_RETRIES + 1):
+                async with PlatformCall(
+                    "Spotify", failure_errors=(aiohttp.ClientError, asyncio.TimeoutError)
+                ) as call:
+                    async with self._session.request(method, url, headers=headers, **kwargs) as response:
+                        try:
+                            data = await response.json(content_type=None)
+                        except Exception:
+                            data = None
+                        status = response.status
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    call.record_status(status, retry_after)
+
+                if status != 429:
+                    break
+                if retry_after is not None and retry_after > SPOTIFY_MAX_RETRY_AFTER:
+                    break
+
+            if status >= 400:
+                logger.error(f"Spotify API error: {status}, {data}")
+            return status, data
+
+    async def search_artist(self, artist_name):
+        cache_key = ("Spotify", normalize_query(artist_name))
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        status, data = await self._request(
+            "GET", "/search", params={"q": artist_name, "type": "artist", "limit": 5}
+        )
+        if status == 200 and data and "artists" in data:
+            search_cache.set(cache_key, data)
+        return data or {}
+
+    async def get_artists_info(self, artist_ids):
+        # Пачки по 50 id запрашиваются параллельно; результат - {artist_id: info или None}
+        results = {artist_id: None for artist_id in artist_ids}
+        ids = list(results)
+        chunks = [ids[i:i + ARTISTS_BATCH_SIZE] for i in range(0, len(ids), ARTISTS_BATCH_SIZE)]
+
+        responses = await asyncio.gather(
+            *(self._request("GET", "/artists", params={"ids": ",".join(chunk)}) for chunk in chunks),
+            return_exceptions=True
+        )
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.error(f"Error in get_artists_info: {response}")
+                continue
+            status, data = response
+            if status != 200 or not data:
+                continue
+            for artist in data.get("artists", []):
+                if artist:
+                    results[artist["id"]] = _format_spotify_artist(artist)
+        return results
+
+    async def get_artist_info(self, artist_id):
+        try:
+            status, data = await self._request("GET", f"/artists/{artist_id}")
+            if status == 200 and data:
+                return _format_spotify_artist(data)
+        except Exception as e:
+            logger.error(f"Error in get_artist_info: {e}")
+        return None
+
+    async def get_last_releases(self, artist_id):
+        # Как и get_spotify_last_releases, при ошибке бросаем исключение, а не возвращаем пустой ответ
+        album = None
+        single = None
+        path = f"/artists/{artist_id}/albums"
+        status, data = await self._request(
+            "GET", path, params={"limit": SPOTIFY_RELEASES_PAGE_SIZE, "include_groups": "album,single"}
+        )
+        if status != 200:
+            raise SpotifyAPIError(f"Spotify API error: {status}, {data}")
+        data = data or {}
+
+        for item in data.get("items", []):
+            group = item.get("album_group") or item.get("album_type")
+            if group == "album":
+                album = _newest_release(album, item)
+            elif group == "single":
+                single = _newest_release(single, item)
+
+        # Синглы не поместились на первую страницу - запрашиваем последний отдельно
+        if single is None and data.get("next"):
+            status, data = await self._request(
+                "GET", path, params={"limit": 1, "include_groups": "single"}
+            )
+            if status != 200:
+                raise SpotifyAPIError(f"Spotify API error: {status}, {data}")
+            if data and data.get("items"):
+                single = _format_spotify_release(data["items"][0])
+        return album, single
+
+    async def get_top_tracks(self, artist_id):
+        try:
+            status, data = await self._request(
+                "GET", f"/artists/{artist_id}/top-tracks", params={"market": "RU"}
+            )
+            if status == 200 and data:
+                return _format_spotify_tracks(data["tracks"])
+        except Exception as e:
+            logger.error(f"Error in get_top_tracks: {e}")
+        return None
+
+    async def create_playlist(self, tracks, user_name):
+        try:
+            status, user = await self._request("GET", "/me")
+            if status != 200 or not user:
+                logger.error(f"Failed to get Spotify user info: {status}")
+                return None
+
+            status, playlist = await self._request(
+                "POST",
+                f"/users/{user['id']}/playlists",
+                json={
+                    "name": f"Микс для {user_name}",
+                    "description": "Создано ботом MusicHorn",
+                    "public": True
+                }
+            )
+            if status != 201 or not playlist:
+                logger.error(f"Failed to create Spotify playlist: {status}")
+                return None
+
+            playlist_id = playlist["id"]
+            track_uris = [
+                f"spotify:track:{track['link'].split('/')[-1]}"
+                for track in tracks if 'link' in track
+            ]
+
+            # Добавляем треки порциями по 100
+            for i in range(0, len(track_uris), 100):
+                status, _ = await self._request(
+                    "POST", f"/playlists/{playlist_id}/tracks", json={"uris": track_uris[i:i + 100]}
+                )
+                if status != 201:
+                    logger.error(f"Failed to add tracks to Spotify playlist: {status}")
+                    return None
+
+            logger.info(f"Created Spotify playlist with ID: {playlist_id}")
+            return f"https://open.spotify.com/playlist/{playlist_id}"
+        except Exception as e:
+            logger.error(f"Error creating Spotify playlist: {e}")
+            return None
+
+    async def delete_old_mix(self, user_name):
+        try:
+            status, user = await self._request("GET", "/me")
+            if status != 200 or not user:
+                return
+
+            status, playlists = await self._request("GET", f"/users/{user['id']}/playlists")
+            if status != 200 or not playlists:
+                return
+
+            for playlist in playlists.get("items", []):
+                if playlist["name"] == f"Микс для {user_name}":
+                    status, _ = await self._request("DELETE", f"/playlists/{playlist['id']}/followers")
+                    if status == 200:
+                        logger.info(f"Deleted old Spotify mix playlist for user {user_name}")
+                    break
+        except Exception as e:
+            logger.error(f"Error deleting old Spotify playlist: {e}")
+
+    async def replace_playlist(self, tracks, user_name):
+        # Удаляем старый микс пользователя и создаем новый
+        await self.delete_old_mix(user_name)
+        return await self.create_playlist(tracks, user_name)
@@ -1,8 +1,15 @@
 import os
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import random
+import threading
+import time
+from concurrent.futures import Future
 from dotenv import load_dotenv
+from cache import search_cache, normalize_query
+from limits import PlatformCall, parse_retry_after
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -13,10 +20,74 @@ SPOTIFY_REFRESH_TOKEN = os.getenv("SPOTIFY_REFRESH_TOKEN")
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-def get_spotify_token():
+class SpotifyAPIError(Exception):
+    pass
+
+# Таймауты (подключение, чтение) для запросов к API Spotify
+SPOTIFY_TIMEOUT = (5, 15)
+# Размер пула соединений: потоки сканера релизов плюс обработчики бота
+SPOTIFY_POOL_SIZE = int(os.getenv("SPOTIFY_SCAN_WORKERS", "8")) + 4
+
+def create_spotify_session():
+    session = requests.Session()
+    retry_strategy = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET", "PUT", "DELETE"]  # POST не повторяем, чтобы не создать плейлист дважды
+    )
+    adapter = HTTPAdapter(
+        pool_connections=2,  # api.spotify.com и accounts.spotify.com
+        pool_maxsize=SPOTIFY_POOL_SIZE,
+        max_retries=retry_strategy
+    )
+    session.mount("https://", adapter)
+    return session
+
+# Одна сессия с keep-alive на весь процесс; используется потоками бота и планировщика
+spotify_session = create_spotify_session()
+
+# Сколько раз повторять запрос после 429 и сколько максимум готовы ждать
+SPOTIFY_RATE_LIMIT_RETRIES = 2
+SPOTIFY_MAX_RETRY_AFTER = 30
+
+def spotify_request(method, url, **kwargs):
+    kwargs.setdefault("timeout", SPOTIFY_TIMEOUT)
+
+    for attempt in range(SPOTIFY_RATE_LIMIT_RETRIES + 1):
+        # Если Spotify недоступен, сразу отказываем, не занимая поток на время таймаута
+        with PlatformCall("Spotify", failure_errors=(requests.RequestException,)) as call:
+            response = spotify_session.request(method, url, **kwargs)
+            # Spotify сообщает в Retry-After, через сколько секунд можно повторить запрос
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            call.record_status(response.status_code, retry_after)
+
+        if response.status_code != 429:
+            return response
+        if retry_after is not None and retry_after > SPOTIFY_MAX_RETRY_AFTER:
+            break
+
+    return response
+
+# Токен обновляем заранее, за столько секунд до истечения
+TOKEN_REFRESH_MARGIN = 60
+# Пауза перед повторной попыткой, если обновить токен не удалось
+TOKEN_RETRY_DELAY = 30
+
+# (access_token, момент истечения); кортеж заменяется целиком, поэтому читается без блокировки
+_cached_token = (None, 0)
+_token_lock = threading.Lock()
+
+def _is_token_fresh(margin=TOKEN_REFRESH_MARGIN):
+    token, expires_at = _cached_token
+    return token is not None and time.time() < expires_at - margin
+
+def _refresh_spotify_token():
+    global _cached_token
     try:
         # Используем refresh token для получения нового access token
-        auth_response = requests.post(
+        auth_response = spotify_request(
+            "POST",
             'https://accounts.spotify.com/api/token',
             data={
                 'grant_type': 'refresh_token',
@@ -29,96 +100,238 @@ def get_spotify_token():
         if auth_response.status_code != 200:
             logger.error(f"Failed to refresh Spotify token: {auth_response.text}")
             return None
-            
-        return auth_response.json()['access_token']
+
+        data = auth_response.json()
+        _cached_token = (data['access_token'], time.time() + data.get('expires_in', 3600))
+        logger.info("Spotify token refreshed")
+        return data['access_token']
     except Exception as e:
         logger.error(f"Error getting Spotify token: {e}")
         return None
 
+def get_spotify_token():
+    if _is_token_fresh():
+        return _cached_token[0]
+
+    # Обновляет только один поток, остальные ждут и получают уже новый токен
+    with _token_lock:
+        if _is_token_fresh():
+            return _cached_token[0]
+        return _refresh_spotify_token()
+
+def start_token_refresher():
+    # Фоновое обновление токена, чтобы пользовательские запросы не ждали его получения
+    def refresher():
+        last_attempt = 0
+        while True:
+            try:
+                _, expires_at = _cached_token
+                # Не чаще раза в TOKEN_REFRESH_MARGIN, даже если токен живет меньше двойного запаса
+                delay = max(
+                    expires_at - 2 * TOKEN_REFRESH_MARGIN,
+                    last_attempt + TOKEN_REFRESH_MARGIN
+                ) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                    continue
+
+                with _token_lock:
+                    refreshed = _is_token_fresh(2 * TOKEN_REFRESH_MARGIN) or _refresh_spotify_token()
+                last_attempt = time.time()
+                # Пауза после ошибки - уже без блокировки, чтобы get_spotify_token не ждал ее
+                if not refreshed:
+                    time.sleep(TOKEN_RETRY_DELAY)
+            except Exception as e:
+                logger.error(f"Error in Spotify token refresher: {e}")
+                time.sleep(TOKEN_RETRY_DELAY)
+
+    thread = threading.Thread(target=refresher, daemon=True, name="spotify-token-refresher")
+    thread.start()
+    return thread
+
 def search_artist(artist_name):
+    cache_key = ("Spotify", normalize_query(artist_name))
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     token = get_spotify_token()
     url = "https://api.spotify.com/v1/search"
     headers = {"Authorization": f"Bearer {token}"}
     params = {"q": artist_name, "type": "artist", "limit": 5}
-    response = requests.get(url, headers=headers, params=params)
-    return response.json()
+    response = spotify_request("GET", url, headers=headers, params=params)
+    result = response.json()
 
-def get_spotify_artist_info(artist_id):
+    # Ошибки API не кэшируем
+    if response.status_code == 200 and "artists" in result:
+        search_cache.set(cache_key, result)
+    return result
+
+# /v1/artists?ids= принимает не больше 50 id за запрос
+ARTISTS_BATCH_SIZE = 50
+# Сколько ждем остальные запросы перед отправкой неполной пачки
+ARTISTS_BATCH_WINDOW = 0.05
+
+_artist_batch_lock = threading.Lock()
+_pending_artist_lookups = {}  # artist_id -> [Future]
+
+def _format_spotify_artist(data):
+    return {
+        "name": data["name"],
+        "followers": data["followers"]["total"],
+        "link": data["external_urls"]["spotify"],
+        "image": data["images"][0]["url"] if data.get("images") else None
+    }
+
+def get_spotify_artists_info(artist_ids):
+    # Возвращает {artist_id: info или None}, запрашивая артистов пачками по 50
+    results = {artist_id: None for artist_id in artist_ids}
     try:
         token = get_spotify_token()
         if not token:
             logger.error("Spotify token is missing or invalid.")
-            return None
+            return results
 
-        url = f"https://api.spotify.com/v1/artists/{artist_id}"
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                "name": data["name"],
-                "followers": data["followers"]["total"],
-                "link": data["external_urls"]["spotify"]
-            }
-        else:
-            logger.error(f"Spotify API error: {response.status_code}, {response.text}")
+        ids = list(results)
+        for i in range(0, len(ids), ARTISTS_BATCH_SIZE):
+            chunk = ids[i:i + ARTISTS_BATCH_SIZE]
+            response = spotify_request(
+                "GET",
+                "https://api.spotify.com/v1/artists",
+                headers=headers,
+                params={"ids": ",".join(chunk)}
+            )
+
+            if response.status_code != 200:
+                logger.error(f"Spotify API error: {response.status_code}, {response.text}")
+                continue
+
+            for data in response.json().get("artists", []):
+                if data:
+                    results[data["id"]] = _format_spotify_artist(data)
+    except Exception as e:
+        logger.error(f"Error in get_spotify_artists_info: {e}")
+    return results
+
+def _flush_artist_lookups():
+    global _pending_artist_lookups
+    with _artist_batch_lock:
+        pending, _pending_artist_lookups = _pending_artist_lookups, {}
+    if not pending:
+        return
+
+    results = get_spotify_artists_info(list(pending))
+    for artist_id, futures in pending.items():
+        for future in futures:
+            future.set_result(results.get(artist_id))
+
+def request_spotify_artist_info(artist_id):
+    # Ставит артиста в очередь; запросы из разных потоков объединяются в одну пачку
+    future = Future()
+    with _artist_batch_lock:
+        waiting = _pending_artist_lookups.setdefault(artist_id, [])
+        waiting.append(future)
+        first_in_batch = len(_pending_artist_lookups) == 1 and len(waiting) == 1
+        batch_full = len(_pending_artist_lookups) >= ARTISTS_BATCH_SIZE
+
+    if batch_full:
+        _flush_artist_lookups()
+    elif first_in_batch:
+        timer = threading.Timer(ARTISTS_BATCH_WINDOW, _flush_artist_lookups)
+        timer.daemon = True
+        timer.start()
+    return future
+
+def get_spotify_artist_info(artist_id):
+    try:
+        return request_spotify_artist_info(artist_id).result(timeout=30)
     except Exception as e:
         logger.error(f"Error in get_spotify_artist_info: {e}")
     return None
 
+# Размер страницы при запросе релизов артиста (максимум для /artists/{id}/albums)
+SPOTIFY_RELEASES_PAGE_SIZE = 50
+
+def _format_spotify_release(item):
+    return {
+        "id": item["id"],
+        "name": item["name"],
+        "release_date": item.get("release_date", "N/A"),
+        "link": item["external_urls"]["spotify"]
+    }
+
+def _newest_release(current, item):
+    info = _format_spotify_release(item)
+    if current is None or info["release_date"] > current["release_date"]:
+        return info
+    return current
+
 def get_spotify_last_releases(artist_id):
     token = get_spotify_token()
     headers = {"Authorization": f"Bearer {token}"}
+    url = f"https://api.spotify.com/v1/artists/{artist_id}/albums"
 
-    # Получаем последний альбом
-    album_params = {"limit": 1, "include_groups": "album"}
-    album_response = requests.get(
-        f"https://api.spotify.com/v1/artists/{artist_id}/albums",
+    # Альбомы и синглы одним запросом. Spotify отдает их сгруппированными
+    # (сначала альбомы, затем синглы), внутри группы - от новых к старым
+    response = spotify_request(
+        "GET",
+        url,
         headers=headers,
-        params=album_params
-    )
-
-    # Получаем последний сингл
-    single_params = {"limit": 1, "include_groups": "single"}
-    single_response = requests.get(
-        f"https://api.spotify.com/v1/artists/{artist_id}/albums",
-        headers=headers,
-        params=single_params
+        params={"limit": SPOTIFY_RELEASES_PAGE_SIZE, "include_groups": "album,single"}
     )
 
     album = None
     single = None
 
-    if album_response.status_code == 200:
-        albums = album_response.json().get("items", [])
-        if albums:
-            album = {
-                "id": albums[0]["id"],
-                "name": albums[0]["name"],
-                "release_date": albums[0].get("release_date", "N/A"),
-                "link": albums[0]["external_urls"]["spotify"]
-            }
+    # Ошибку не превращаем в пустой ответ: сканер не должен считать такого артиста проверенным
+    if response.status_code != 200:
+        raise SpotifyAPIError(f"Spotify API error: {response.status_code}, {response.text}")
 
-    if single_response.status_code == 200:
+    data = response.json()
+    for item in data.get("items", []):
+        group = item.get("album_group") or item.get("album_type")
+        if group == "album":
+            album = _newest_release(album, item)
+        elif group == "single":
+            single = _newest_release(single, item)
+
+    # У артистов с большой дискографией синглы не помещаются на первую страницу:
+    # вместо перелистывания всех альбомов запрашиваем один последний сингл
+    if single is None and data.get("next"):
+        single_response = spotify_request(
+            "GET",
+            url,
+            headers=headers,
+            params={"limit": 1, "include_groups": "single"}
+        )
+        if single_response.status_code != 200:
+            raise SpotifyAPIError(f"Spotify API error: {single_response.status_code}, {single_response.text}")
         singles = single_response.json().get("items", [])
         if singles:
-            single = {
-                "id": singles[0]["id"],
-                "name": singles[0]["name"],
-                "release_date": singles[0].get("release_date", "N/A"),
-                "link": singles[0]["external_urls"]["spotify"]
-            }
+            single = _format_spotify_release(singles[0])
 
     return album, single
 
+def _format_spotify_tracks(tracks_data):
+    tracks = []
+    for track in tracks_data:
+        # Проверяем длительность трека (duration_ms в миллисекундах)
+        if track["duration_ms"] >= 60000:  # 60000 мс = 1 минута
+            tracks.append({
+                "name": track["name"],
+                "link": track["external_urls"]["spotify"]
+            })
+    return tracks
+
 def get_spotify_top_tracks(artist_id):
     try:
         token = get_spotify_token()
         headers = {"Authorization": f"Bearer {token}"}
         
         # Получаем топ треки артиста
-        response = requests.get(
+        response = spotify_request(
+            "GET",
             f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks?market=RU",
             headers=headers
         )
@@ -126,18 +339,7 @@ def get_spotify_top_tracks(artist_id):
         if response.status_code != 200:
             return None
             
-        tracks_data = response.json()["tracks"]
-        tracks = []
-        
-        for track in tracks_data:
-            # Проверяем длительность трека (duration_ms в миллисекундах)
-            if track["duration_ms"] >= 60000:  # 60000 мс = 1 минута
-                tracks.append({
-                    "name": track["name"],
-                    "link": track["external_urls"]["spotify"]
-                })
-        
-        return tracks
+        return _format_spotify_tracks(response.json()["tracks"])
     except Exception as e:
         logger.error(f"Error in get_spotify_top_tracks: {e}")
         return None
@@ -155,7 +357,8 @@ def create_spotify_playlist(tracks, user_name):
         }
         
         # Получаем ID пользователя Spotify
-        user_response = requests.get(
+        user_response = spotify_request(
+            "GET",
             "https://api.spotify.com/v1/me",
             headers=headers
         )
@@ -177,7 +380,8 @@ def create_spotify_playlist(tracks, user_name):
             "public": True
         }
         
-        playlist_response = requests.post(
+        playlist_response = spotify_request(
+            "POST",
             f"https://api.spotify.com/v1/users/{user_id}/playlists",
             headers=headers,
             json=playlist_data
@@ -201,7 +405,8 @@ def create_spotify_playlist(tracks, user_name):
         # Добавляем треки порциями по 100
         for i in range(0, len(track_uris), 100):
             chunk = track_uris[i:i + 100]
-            add_tracks_response = requests.post(
+            add_tracks_response = spotify_request(
+                "POST",
                 f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks",
                 headers=headers,
                 json={"uris": chunk}
@@ -228,7 +433,8 @@ def delete_old_spotify_mix(token, user_name):
         }
         
         # Получаем ID пользователя
-        user_response = requests.get(
+        user_response = spotify_request(
+            "GET",
             "https://api.spotify.com/v1/me",
             headers=headers
         )
@@ -239,7 +445,8 @@ def delete_old_spotify_mix(token, user_name):
         user_id = user_response.json()['id']
         
         # Получаем плейлисты пользователя
-        playlists_response = requests.get(
+        playlists_response = spotify_request(
+            "GET",
             f"https://api.spotify.com/v1/users/{user_id}/playlists",
             headers=headers
         )
@@ -252,7 +459,8 @@ def delete_old_spotify_mix(token, user_name):
         for playlist in playlists_response.json()['items']:
             if playlist['name'] == f"Микс для {user_name}":
                 # Удаляем найденный плейлист
-                delete_response = requests.delete(
+                delete_response = spotify_request(
+                    "DELETE",
                     f"https://api.spotify.com/v1/playlists/{playlist['id']}/followers",
                     headers=headers
                 )
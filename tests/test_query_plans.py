@@ -0,0 +1,74 @@
+import importlib
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Частые запросы бота и сканера: план каждого запроса, который они выполняют, должен использовать индекс
+HOT_CALLS = {
+    "has_subscription": lambda db: db.has_subscription(1001, "artist-1"),
+    "get_subscriptions": lambda db: db.get_subscriptions(1001),
+    "get_user_profile": lambda db: db.get_user_profile(1001),
+    "can_add_subscription": lambda db: db.can_add_subscription(1001),
+    "remove_subscription": lambda db: db.remove_subscription(1002, artist_id="artist-2"),
+    "update_subscription_date": lambda db: db.update_subscription_date(1001, "artist-1", "2026-01-01"),
+    "get_pending_payments": lambda db: db.get_pending_payments(),
+    "get_payment_history": lambda db: db.get_payment_history(1001),
+    "get_payment_by_id": lambda db: db.get_payment_by_id(1),
+    "is_release_known": lambda db: db.is_release_known("artist-1", "Spotify", "release-1"),
+    "get_pending_notifications": lambda db: db.get_pending_notifications(time.time(), 30),
+    "get_artist": lambda db: db.get_artist("Spotify", "artist-1"),
+    "load_top_tracks": lambda db: db.load_top_tracks(("Spotify", "artist-1")),
+    "get_artist_subscribers": lambda db: db.get_artist_subscribers([(0, 2 ** 31), (2 ** 31 + 5, 2 ** 32)]),
+    "get_release_cadence": lambda db: db.get_release_cadence([("Spotify", "artist-1"), ("Yandex Music", "artist-2")])
+}
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    # database.py создает database.db и database.log в текущем каталоге
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("db"))
+    try:
+        database = importlib.import_module("database")
+        for chat_id in (1001, 1002):
+            database.add_user(chat_id)
+        database.add_subscription(1001, "artist-1", "Artist 1", "Spotify")
+        database.add_subscription(1002, "artist-2", "Artist 2", "Yandex Music")
+        database.create_payment_request(1001, 1, 10)
+        yield database
+    finally:
+        os.chdir(cwd)
+
+def capture_statements(db, call):
+    # SQL, который функция действительно выполняет, с подставленными параметрами
+    statements = []
+    connection = db.get_connection()
+    connection.set_trace_callback(statements.append)
+    try:
+        call(db)
+    finally:
+        connection.set_trace_callback(None)
+    return [
+        statement for statement in statements
+        if statement.split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE")
+    ]
+
+@pytest.mark.parametrize("name", sorted(HOT_CALLS))
+def test_hot_query_uses_index(db, name):
+    statements = capture_statements(db, HOT_CALLS[name])
+    assert statements, f"{name} did not run any queries"
+
+    cursor = db.get_connection().cursor()
+    for statement in statements:
+        plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()]
+        scans = [step for step in plan if step.startswith("SCAN")]
+        assert not scans, f"{name} scans a table: {statement.strip()} -> {plan}"
+
+def test_artist_subscribers_by_scan_hash(db):
+    scan_hash = db.get_scan_hash("Spotify", "artist-1")
+    assert list(db.get_artist_subscribers([(scan_hash, scan_hash + 1)])) == [("Spotify", "artist-1")]
+    assert ("Spotify", "artist-1") not in db.get_artist_subscribers([(scan_hash + 1, 2 ** 32)])
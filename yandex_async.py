@@ -0,0 +1,237 @@
+import os
+import json
+import asyncio
+import logging
+from yandex_music import ClientAsync
+from yandex_music.exceptions import NetworkError
+from yandex_music.utils.request_async import Request
+from limits import PlatformCall
+from cache import search_cache, normalize_query
+from yandex_common import (
+    YANDEX_RESPONSE_ERRORS,
+    YANDEX_PROBE_PAGE_SIZE,
+    YANDEX_ALBUM_FALLBACK_PAGE_SIZE,
+    YANDEX_API_URL,
+    YANDEX_PLAYLIST_OWNER_UID,
+    _pick_last_releases,
+    _format_yandex_tracks,
+    _format_yandex_artist,
+    _yandex_playlist_link
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов к Яндекс.Музыке может выполняться одновременно
+YANDEX_ASYNC_CONCURRENCY = int(os.getenv("YANDEX_ASYNC_CONCURRENCY", "20"))
+
+class GuardedAsyncRequest(Request):
+    """Запросы ClientAsync проходят через общие с синхронным клиентом ограничитель скорости и предохранитель"""
+
+    async def _request_wrapper(self, *args, **kwargs):
+        # Если Яндекс.Музыка недоступна, сразу отказываем, не дожидаясь таймаута
+        async with PlatformCall(
+            "Yandex Music", failure_errors=(NetworkError,), response_errors=YANDEX_RESPONSE_ERRORS
+        ) as call:
+            try:
+                return await super()._request_wrapper(*args, **kwargs)
+            except NetworkError as e:
+                # Библиотека не отдает заголовки ответа, поэтому Retry-After недоступен
+                if "(429)" in str(e):
+                    call.record_rate_limited()
+                raise
+
+class AsyncYandexClient:
+    """Асинхронный адаптер Яндекс.Музыки поверх ClientAsync с ограничением параллельных запросов.
+
+    Использование:
+        async with AsyncYandexClient() as client:
+            album, single = await client.get_last_releases(artist_id)
+    """
+
+    def __init__(self, token=None, base_url=None, concurrency=YANDEX_ASYNC_CONCURRENCY):
+        self.token = token or os.getenv("YANDEX_MUSIC_TOKEN")
+        self.base_url = base_url
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._client = None
+
+    async def open(self):
+        if self._client is None:
+            self._client = await ClientAsync(
+                self.token,
+                base_url=self.base_url,
+                request=GuardedAsyncRequest()
+            ).init()
+        return self._client
+
+    async def _call(self, method, *args, **kwargs):
+        client = await self.open()
+        async with self._semaphore:
+            return await getattr(client, method)(*args, **kwargs)
+
+    async def get_artist_info(self, artist_id):
+        try:
+            artists = await self._call("artists", artist_id)
+            if artists:
+                return _format_yandex_artist(artists[0])
+        except Exception as e:
+            logger.error(f"Error in get_artist_info: {e}")
+        return None
+
+    async def search_artist(self, artist_name):
+        cache_key = ("Yandex Music", normalize_query(artist_name))
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            search_result = await self._call("search", artist_name, type_="artist")
+            if search_result and search_result.artists:
+                artists = search_result.artists.results[:5]
+                search_cache.set(cache_key, artists)
+                return artists
+        except Exception as e:
+            logger.error(f"Error in search_artist: {e}")
+        return None
+
+    async def get_last_releases(self, artist_id):
+        # Как и get_yandex_last_releases, ошибки пробрасываем: пустой ответ означает "релизов нет",
+        # а не "платформа недоступна"
+        direct_albums = await self._call(
+            "artists_direct_albums",
+            artist_id,
+            page=0,
+            page_size=YANDEX_PROBE_PAGE_SIZE,
+            sort_by='year'
+        )
+        releases = direct_albums.albums if direct_albums else []
+        album, single = _pick_last_releases(releases)
+
+        # Среди первых релизов нет альбома или сингла - ищем его на более длинной странице
+        if (album is None or single is None) and len(releases) >= YANDEX_PROBE_PAGE_SIZE:
+            direct_albums = await self._call(
+                "artists_direct_albums",
+                artist_id,
+                page=0,
+                page_size=YANDEX_ALBUM_FALLBACK_PAGE_SIZE,
+                sort_by='year'
+            )
+            fallback_album, fallback_single = _pick_last_releases(direct_albums.albums if direct_albums else [])
+            album = album or fallback_album
+            single = single or fallback_single
+
+        return album, single
+
+    async def get_top_tracks(self, artist_id):
+        try:
+            artists = await self._call("artists", artist_id)
+            if not artists:
+                return None
+
+            tracks = artists[0].popular_tracks
+            if not tracks:
+                # Если нет списка популярных треков, берем первую страницу треков артиста
+                artist_tracks = await self._call("artists_tracks", artist_id, page_size=10)
+                tracks = artist_tracks.tracks if artist_tracks else None
+                if not tracks:
+                    return None
+
+            return _format_yandex_tracks(tracks)
+        except Exception as e:
+            logger.error(f"Error in get_top_tracks: {e}")
+            return None
+
+    async def _post(self, url, data):
+        # Запрос к API, для которого в ClientAsync нет готового метода
+        client = await self.open()
+        async with self._semaphore:
+            return await client._request.post(url, data, timeout=30)
+
+    async def create_playlist(self, tracks, title="Случайный микс"):
+        # Как и create_yandex_playlist: плейлист передается аккаунту-владельцу,
+        # треки добавляются от его имени, а ссылка ведет на его профиль
+        try:
+            client = await self.open()
+            playlist = await self._call("users_playlists_create", title=title, visibility="public")
+            logger.info(f"Created playlist with kind={playlist.kind}")
+
+            response = await self._post(
+                f"{YANDEX_API_URL}/users/{client.me.account.uid}/playlists/{playlist.kind}/change-owner",
+                {
+                    "owner": YANDEX_PLAYLIST_OWNER_UID,
+                    "kind": playlist.kind,
+                    "revision": playlist.revision
+                }
+            )
+            if not isinstance(response, dict):
+                logger.error(f"Failed to change playlist owner: {response}")
+                return None
+        except Exception as e:
+            logger.error(f"Failed to create/modify playlist: {e}")
+            return None
+
+        track_ids = []
+        for track in tracks:
+            if 'link' in track:
+                try:
+                    track_ids.append(int(track['link'].split('/')[-1]))
+                except ValueError:
+                    continue
+
+        try:
+            # Альбомы всех треков получаем одним запросом
+            track_infos = await self._call("tracks", track_ids) if track_ids else []
+        except Exception as e:
+            logger.error(f"Error in create_playlist: {e}")
+            return None
+
+        diff = [{
+            'op': 'insert',
+            'at': 0,
+            'tracks': [
+                {'id': int(info.id), 'albumId': int(info.albums[0].id)}
+                for info in track_infos if info and info.albums
+            ]
+        }]
+        if not diff[0]['tracks']:
+            logger.error("No valid tracks found")
+            return None
+
+        try:
+            response = await self._post(
+                f"{YANDEX_API_URL}/users/{YANDEX_PLAYLIST_OWNER_UID}/playlists/{playlist.kind}/change-relative",
+                {
+                    'kind': playlist.kind,
+                    'revision': playlist.revision,
+                    'diff': json.dumps(diff)
+                }
+            )
+            if isinstance(response, dict):
+                logger.info(f"Successfully added {len(diff[0]['tracks'])} tracks")
+            else:
+                logger.error(f"Failed to modify playlist: {response}")
+        except Exception as e:
+            logger.error(f"Error in playlist modification: {e}")
+        return _yandex_playlist_link(playlist.kind)
+
+    async def delete_old_mix(self, username):
+        try:
+            playlists = await self._call("users_playlists_list")
+            for playlist in playlists:
+                if playlist.title == f"Микс для {username}":
+                    await self._call("users_playlists_delete", kind=playlist.kind)
+                    logger.info(f"Deleted old mix playlist for user {username}")
+                    break
+        except Exception as e:
+            logger.error(f"Error deleting old playlist: {e}")
+
+    async def replace_playlist(self, tracks, username):
+        # Удаляем старый микс пользователя и создаем новый
+        await self.delete_old_mix(username)
+        return await self.create_playlist(tracks, f"Микс для {username}")
@@ -0,0 +1,72 @@
+from yandex_music.exceptions import NotFoundError, BadRequestError, UnauthorizedError
+
+# Общие для синхронного и асинхронного клиентов константы и форматирование ответов Яндекс.Музыки.
+# Модуль не обращается к сети при импорте, поэтому его можно импортировать откуда угодно
+
+# Ошибки, означающие, что сервис ответил: для предохранителя это не сбой платформы
+YANDEX_RESPONSE_ERRORS = (NotFoundError, BadRequestError, UnauthorizedError)
+
+# Сколько последних релизов запрашивать при поиске новинок
+YANDEX_PROBE_PAGE_SIZE = 10
+# Если среди первых релизов нет альбома (например, одни синглы) или нет сингла (одни альбомы),
+# ищем недостающий релиз на более длинной странице.
+# Релиз, вышедший раньше последних 50 релизов, не будет найден - это осознанный компромисс
+YANDEX_ALBUM_FALLBACK_PAGE_SIZE = 50
+
+# Аккаунт, которому передаются созданные ботом плейлисты с миксами
+YANDEX_API_URL = "https://api.music.yandex.net"
+YANDEX_PLAYLIST_OWNER_UID = "421035053"  # ID пользователя baloyan.dedpool
+YANDEX_PLAYLIST_OWNER_LOGIN = "baloyan.dedpool"
+
+def _format_yandex_artist(artist):
+    return {
+        "name": artist.name,
+        "followers": "N/A",
+        "link": f"https://music.yandex.ru/artist/{artist.id}",
+        "image": artist.get_og_image_url() if artist.og_image else None
+    }
+
+def _format_yandex_release(release):
+    # Если точной даты нет, используем год выпуска
+    release_date = release.release_date or (str(release.year) if release.year else "N/A")
+    return {
+        "id": str(release.id),  # Добавляем ID как строку
+        "name": release.title,
+        "release_date": release_date,
+        "link": f"https://music.yandex.ru/album/{release.id}"
+    }
+
+def _pick_last_releases(releases):
+    # Выбираем самый новый альбом и самый новый сингл
+    album = None
+    single = None
+
+    # Релизы без даты ("N/A") считаем самыми старыми
+    def release_key(info):
+        return "" if info is None or info["release_date"] == "N/A" else info["release_date"]
+
+    for release in releases:
+        info = _format_yandex_release(release)
+        if release.type == 'single':
+            if single is None or release_key(info) > release_key(single):
+                single = info
+        elif album is None or release_key(info) > release_key(album):
+            album = info
+
+    return album, single
+
+def _format_yandex_tracks(tracks):
+    all_tracks = []
+    # Берем только первые 10 треков
+    for track in tracks[:10]:
+        # Проверяем длительность трека
+        if track.duration_ms and track.duration_ms >= 60000:  # 60000 мс = 1 минута
+            all_tracks.append({
+                "name": track.title,
+                "link": f"https://music.yandex.ru/track/{track.id}"
+            })
+    return all_tracks
+
+def _yandex_playlist_link(kind):
+    # Ссылка на плейлист у аккаунта-владельца
+    return f"https://music.yandex.ru/users/{YANDEX_PLAYLIST_OWNER_LOGIN}/playlists/{kind}"
@@ -2,13 +2,44 @@ import os
 import logging
 import random
 from yandex_music import Client
+from yandex_music.exceptions import NetworkError
+from yandex_music.utils.request import Request
+from limits import PlatformCall
+from yandex_common import (
+    YANDEX_RESPONSE_ERRORS,
+    YANDEX_PROBE_PAGE_SIZE,
+    YANDEX_ALBUM_FALLBACK_PAGE_SIZE,
+    YANDEX_API_URL,
+    YANDEX_PLAYLIST_OWNER_UID,
+    _pick_last_releases,
+    _format_yandex_tracks,
+    _format_yandex_artist,
+    _yandex_playlist_link
+)
 from dotenv import load_dotenv
+from cache import search_cache, normalize_query
 import json
 import time
 
+class GuardedRequest(Request):
+    """Все запросы клиента Яндекс.Музыки проходят через общие ограничитель скорости и предохранитель"""
+
+    def _request_wrapper(self, *args, **kwargs):
+        # Если Яндекс.Музыка недоступна, сразу отказываем, не дожидаясь таймаута
+        with PlatformCall(
+            "Yandex Music", failure_errors=(NetworkError,), response_errors=YANDEX_RESPONSE_ERRORS
+        ) as call:
+            try:
+                return super()._request_wrapper(*args, **kwargs)
+            except NetworkError as e:
+                # Библиотека не отдает заголовки ответа, поэтому Retry-After недоступен
+                if "(429)" in str(e):
+                    call.record_rate_limited()
+                raise
+
 # Загрузка переменных окружения
 load_dotenv()
-yandex_client = Client(os.getenv("YANDEX_MUSIC_TOKEN")).init()
+yandex_client = Client(os.getenv("YANDEX_MUSIC_TOKEN"), request=GuardedRequest()).init()
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -17,62 +48,71 @@ def get_yandex_artist_info(artist_id):
     try:
         artist = yandex_client.artists(artist_id)[0]  # Получаем первого артиста из списка
         logger.info(f"Yandex artist data: {artist}")  # Добавим лог для отладки
-        return {
-            "name": artist.name,
-            "followers": "N/A",
-            "link": f"https://music.yandex.ru/artist/{artist_id}"
-        }
+        return _format_yandex_artist(artist)
     except Exception as e:
         logger.error(f"Error in get_yandex_artist_info: {e}")
     return None
 
+# Сколько артистов запрашивать у Яндекс.Музыки за один вызов
+YANDEX_ARTISTS_BATCH_SIZE = 50
+
+def get_yandex_artists_info(artist_ids):
+    # Возвращает {artist_id: info или None}, запрашивая артистов пачками
+    results = {str(artist_id): None for artist_id in artist_ids}
+    ids = list(results)
+    for i in range(0, len(ids), YANDEX_ARTISTS_BATCH_SIZE):
+        try:
+            for artist in yandex_client.artists(ids[i:i + YANDEX_ARTISTS_BATCH_SIZE]):
+                if artist and str(artist.id) in results:
+                    results[str(artist.id)] = _format_yandex_artist(artist)
+        except Exception as e:
+            logger.error(f"Error in get_yandex_artists_info: {e}")
+    return results
+
 def search_yandex_artist(artist_name):
+    cache_key = ("Yandex Music", normalize_query(artist_name))
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         search_result = yandex_client.search(artist_name, type_="artist")
         if search_result and search_result.artists:
-            return search_result.artists.results[:5]  # Возвращаем первые 5 артистов
+            artists = search_result.artists.results[:5]  # Возвращаем первые 5 артистов
+            search_cache.set(cache_key, artists)
+            return artists
         return None
     except Exception as e:
         logger.error(f"Ошибка при поиске артиста в Yandex Music: {e}")
         return None
 
 def get_yandex_last_releases(artist_id):
-    try:
-        artist = yandex_client.artists(artist_id)[0]
-        albums = []
-        singles = []
+    # Ошибки (в том числе CircuitOpenError и NetworkError) не перехватываем: сканер должен отличать
+    # недоступную платформу от артиста без релизов и не считать такого артиста проверенным.
+    # Запрашиваем только первую страницу собственных релизов артиста,
+    # отсортированных по году, без загрузки карточки артиста
+    direct_albums = yandex_client.artists_direct_albums(
+        artist_id,
+        page=0,
+        page_size=YANDEX_PROBE_PAGE_SIZE,
+        sort_by='year'
+    )
 
-        for release in artist.get_albums():
-            if release.type == 'single':
-                singles.append(release)
-            else:
-                albums.append(release)
-
-        album = None
-        single = None
-
-        if albums:
-            latest_album = albums[0]
-            album = {
-                "id": str(latest_album.id),  # Добавляем ID как строку
-                "name": latest_album.title,
-                "release_date": latest_album.release_date if latest_album.release_date else "N/A",
-                "link": f"https://music.yandex.ru/album/{latest_album.id}"
-            }
+    releases = direct_albums.albums if direct_albums else []
+    album, single = _pick_last_releases(releases)
 
-        if singles:
-            latest_single = singles[0]
-            single = {
-                "id": str(latest_single.id),  # Добавляем ID как строку
-                "name": latest_single.title,
-                "release_date": latest_single.release_date if latest_single.release_date else "N/A",
-                "link": f"https://music.yandex.ru/album/{latest_single.id}"
-            }
+    if (album is None or single is None) and len(releases) >= YANDEX_PROBE_PAGE_SIZE:
+        direct_albums = yandex_client.artists_direct_albums(
+            artist_id,
+            page=0,
+            page_size=YANDEX_ALBUM_FALLBACK_PAGE_SIZE,
+            sort_by='year'
+        )
+        fallback_album, fallback_single = _pick_last_releases(direct_albums.albums if direct_albums else [])
+        album = album or fallback_album
+        single = single or fallback_single
 
-        return album, single
-    except Exception as e:
-        logger.error(f"Error in get_yandex_last_releases: {e}")
-        return None, None
+    return album, single
 
 def get_yandex_top_tracks(artist_id):
     try:
@@ -87,18 +127,7 @@ def get_yandex_top_tracks(artist_id):
         else:
             tracks = artist.popular_tracks
         
-        all_tracks = []
-        # Берем только первые 10 треков
-        for track in tracks[:10]:
-            # Проверяем длительность трека
-            if track.duration_ms >= 60000:  # 60000 мс = 1 минута
-                track_info = {
-                    "name": track.title,
-                    "link": f"https://music.yandex.ru/track/{track.id}"
-                }
-                all_tracks.append(track_info)
-        
-        return all_tracks
+        return _format_yandex_tracks(tracks)
         
     except Exception as e:
         logger.error(f"Error in get_yandex_top_tracks: {e}")
@@ -130,7 +159,7 @@ def create_yandex_playlist(tracks, title="Случайный микс"):
             logger.info(f"Created playlist with kind={playlist.kind}")
             
             # Получаем ID владельца плейлиста
-            owner_uid = "421035053"  # ID пользователя baloyan.dedpool
+            owner_uid = YANDEX_PLAYLIST_OWNER_UID
             
             # Изменяем владельца плейлиста
             data = {
@@ -140,7 +169,7 @@ def create_yandex_playlist(tracks, title="Случайный микс"):
             }
             
             # Отправляем запрос на изменение владельца
-            base_url = "https://api.music.yandex.net"
+            base_url = YANDEX_API_URL
             change_owner_url = f"{base_url}/users/{yandex_client.me.account.uid}/playlists/{playlist.kind}/change-owner"
             
             response = yandex_client._request.post(
@@ -218,12 +247,12 @@ def create_yandex_playlist(tracks, title="Случайный микс"):
                 logger.error(f"Failed to modify playlist: {response}")
             
             # Возвращаем ссылку с username
-            return f"https://music.yandex.ru/users/baloyan.dedpool/playlists/{playlist.kind}"
+            return _yandex_playlist_link(playlist.kind)
             
         except Exception as e:
             logger.error(f"Error in playlist modification: {e}")
             # Здесь тоже используем username
-            return f"https://music.yandex.ru/users/baloyan.dedpool/playlists/{playlist.kind}"
+            return _yandex_playlist_link(playlist.kind)
             
     except Exception as e:
         logger.error(f"Error in create_yandex_playlist: {e}")